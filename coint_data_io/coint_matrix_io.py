@@ -1,5 +1,5 @@
 import os
-from typing import Tuple
+from typing import Tuple, List
 
 import pandas as pd
 import numpy as np
@@ -15,10 +15,20 @@ class CointMatrixIO:
         GRANGER = 1
         JOHANSEN = 2
 
-    def __init__(self, test=False):
+    shards_dir = 'shards'
+
+    def __init__(self, test=False, shard: str = None):
+        """
+        :param test: if True, the data directory is relative to the parent directory
+        :param shard: if not None, the files are for a shard of the pairs (e.g., a sector) and are stored in
+                      cointegration_data/shards/<shard>
+        """
         self.test = test
+        self.shard = shard
         self.cointegration_data_dir = 'cointegration_data'
         self.cointegration_data_path = '..' + os.path.sep + self.cointegration_data_dir if self.test else self.cointegration_data_dir
+        if self.shard is not None:
+            self.cointegration_data_path = self.cointegration_data_path + os.path.sep + self.shards_dir + os.path.sep + shard
         self.correlation_file_name = 'correlation.csv'
         self.granger_file_name = 'granger.csv'
         self.johansen_file_name = 'johansen.csv'
@@ -86,6 +96,8 @@ class CointMatrixIO:
         johansen_coint_df.to_csv(self.johansen_file_path, index=False)
 
     def write_files(self, coint_analysis: pd.DataFrame) -> None:
+        if not os.access(self.cointegration_data_path, os.R_OK):
+            os.makedirs(self.cointegration_data_path)
         self.write_correlation_matrix(coint_analysis)
         self.write_cointegration_matrix(coint_analysis)
 
@@ -142,6 +154,24 @@ class CointMatrixIO:
         coint_info_df.index = correlation_df.index
         return coint_info_df
 
+    def merge_shards(self, shard_l: List[str]) -> pd.DataFrame:
+        """
+        Merge the shard files into one correlation/cointegration DataFrame and write the merged files. The
+        columns are in shard order, so if the shards are the sectors in get_pairs order the result is the same
+        as the result of a run over all of the pairs.
+
+        :param shard_l: the shards to merge. All of the shards must have files.
+        :return: the merged DataFrame
+        """
+        shard_df_l = list()
+        for shard in shard_l:
+            shard_io = CointMatrixIO(test=self.test, shard=shard)
+            assert shard_io.has_files(), f'no files for shard {shard}'
+            shard_df_l.append(shard_io.read_files())
+        coint_info_df = pd.concat(shard_df_l, axis=1)
+        self.write_files(coint_info_df)
+        return coint_info_df
+
 
 def main() -> None:
     coint_matrix_io = CointMatrixIO(test=True)
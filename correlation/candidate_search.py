@@ -0,0 +1,108 @@
+
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from correlation.normalize import normalize_columns
+from pairs.pairs import PairUniverse
+
+
+def normalize_returns(close_m: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Calculate the log returns for a window of close prices and normalize each column to a zero mean and a unit
+    length, so the correlation of two columns is the dot product of the normalized columns.
+
+    :param close_m: the close prices for the window (dates x symbols)
+    :return: the normalized returns (dates - 1 x symbols) and a boolean vector that is True for the valid
+             columns. A column with a missing price or with no variance is not valid and is set to zero.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return_m = np.diff(np.log(close_m), axis=0)
+    norm_m = normalize_columns(return_m)
+    valid_a = ~np.isnan(norm_m).any(axis=0)
+    norm_m[:, ~valid_a] = 0.0
+    return norm_m, valid_a
+
+
+class CandidateSearch:
+    """
+    Find candidate pairs across all of the sectors. For each symbol, the k symbols with the most correlated
+    returns in the window are found with blocked matrix products of the normalized returns. Each block
+    calculates the correlation of block_size symbols with all of the symbols, so the memory for the
+    correlation values is block_size x (number of symbols), rather than the full correlation matrix.
+
+    The candidate pairs are much fewer than all of the pairs (about 125k for the S&P 500), so the slower
+    per-pair correlation and cointegration tests can be applied to the cross-sector candidates.
+    """
+
+    cross_sector = 'cross-sector'
+
+    def __init__(self, k: int, block_size: int = 256, min_corr: float = None):
+        """
+        :param k: the number of partners for each symbol
+        :param block_size: the number of symbols in each block
+        :param min_corr: if not None, only candidates with a return correlation >= min_corr are kept
+        """
+        self.k = k
+        self.block_size = block_size
+        self.min_corr = min_corr
+
+    def top_k(self, norm_m: np.ndarray, valid_a: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :param norm_m: the normalized returns (see normalize_returns)
+        :param valid_a: the valid columns
+        :return: the symbol index, the partner index and the correlation for each of the top-k partners
+        """
+        num_syms = norm_m.shape[1]
+        k = min(self.k, max(int(valid_a.sum()) - 1, 0))
+        sym_l = list()
+        partner_l = list()
+        corr_l = list()
+        if k > 0:
+            for block_start in range(0, num_syms, self.block_size):
+                block_end = min(block_start + self.block_size, num_syms)
+                corr_m = norm_m[:, block_start:block_end].T @ norm_m
+                corr_m[:, ~valid_a] = -np.inf
+                block_ix = np.arange(block_end - block_start)
+                corr_m[block_ix, block_start + block_ix] = -np.inf
+                partner_m = np.argpartition(-corr_m, k - 1, axis=1)[:, :k]
+                block_corr_m = np.take_along_axis(corr_m, partner_m, axis=1)
+                block_valid_m = np.repeat(valid_a[block_start:block_end].reshape(-1, 1), k, axis=1)
+                sym_l.append((block_start + np.repeat(block_ix, k))[block_valid_m.ravel()])
+                partner_l.append(partner_m.ravel()[block_valid_m.ravel()])
+                corr_l.append(block_corr_m.ravel()[block_valid_m.ravel()])
+        if len(sym_l) > 0:
+            return np.concatenate(sym_l), np.concatenate(partner_l), np.concatenate(corr_l)
+        return np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'), np.zeros(0)
+
+    def search(self, close_df: pd.DataFrame, sector_info: dict = None) -> Tuple[PairUniverse, np.ndarray]:
+        """
+        :param close_df: the close prices for the window (dates x symbols)
+        :param sector_info: an optional dictionary of sector -> list of stocks in the sector. If it is given,
+                            a pair where both stocks are in the same sector has that sector and other pairs
+                            have the sector 'cross-sector'.
+        :return: the candidate pairs (each pair is included once) and the return correlation for each pair
+        """
+        symbols: List[str] = list(close_df.columns)
+        norm_m, valid_a = normalize_returns(close_df.values.astype('float64'))
+        sym_a, partner_a, corr_a = self.top_k(norm_m, valid_a)
+        if self.min_corr is not None:
+            keep_a = corr_a >= self.min_corr
+            sym_a, partner_a, corr_a = sym_a[keep_a], partner_a[keep_a], corr_a[keep_a]
+        # (A, B) and (B, A) are the same pair
+        index_a = np.minimum(sym_a, partner_a)
+        index_b = np.maximum(sym_a, partner_a)
+        _, first_ix = np.unique(index_a.astype('int64') * len(symbols) + index_b, return_index=True)
+        index_a, index_b, corr_a = index_a[first_ix], index_b[first_ix], corr_a[first_ix]
+        if sector_info is not None:
+            sectors = list(sector_info.keys()) + [self.cross_sector]
+            sym_sector = {sym: code for code, sector in enumerate(sector_info.keys()) for sym in sector_info[sector]}
+            cross_code = len(sectors) - 1
+            symbol_code_a = np.array([sym_sector.get(sym, cross_code) for sym in symbols], dtype='int16')
+            sector_code = np.where(symbol_code_a[index_a] == symbol_code_a[index_b], symbol_code_a[index_a],
+                                   cross_code)
+        else:
+            sectors = [self.cross_sector]
+            sector_code = np.zeros(index_a.shape[0], dtype='int16')
+        return PairUniverse(symbols, sectors, index_a, index_b, sector_code), corr_a
@@ -0,0 +1,15 @@
+
+import numpy as np
+
+
+def normalize_columns(data_m: np.ndarray) -> np.ndarray:
+    """
+    Normalize each column to a zero mean and a unit length, so the correlation of two columns is the dot product
+    of the normalized columns. A column with a missing value or with no variance is set to NaN.
+    """
+    norm_m = data_m - data_m.mean(axis=0)
+    length_a = np.sqrt(np.sum(norm_m * norm_m, axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        norm_m = norm_m / length_a
+    norm_m[:, ~(length_a > 0)] = np.nan
+    return norm_m
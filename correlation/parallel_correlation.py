@@ -0,0 +1,68 @@
+
+from multiprocessing import Pool as ProcessPool
+from typing import Dict
+
+import numpy as np
+
+from correlation.normalize import normalize_columns
+from correlation.window_correlation import log_prices
+from utils.shared_array import SharedArray, attach_worker_arrays, worker_array, worker_params
+
+
+def window_correlation_task(win_ix: int) -> int:
+    """
+    A worker task. Calculate the pair correlations for one window and write them into row win_ix of the shared
+    output array. The log prices, the pair columns and the output are the shared arrays that the worker
+    attached to when it started, so only the window index is passed to the worker.
+
+    :return: the window index
+    """
+    log_m = worker_array('log_prices')
+    pair_a = worker_array('pair_a')
+    pair_b = worker_array('pair_b')
+    corr_m = worker_array('corr')
+    window = worker_params['window']
+    window_start = win_ix * window
+    norm_m = normalize_columns(log_m[window_start:window_start + window])
+    sym_corr_m = norm_m.T @ norm_m
+    corr_m[win_ix] = np.round(sym_corr_m[pair_a, pair_b], worker_params['decimals'])
+    return win_ix
+
+
+def parallel_pair_window_correlation(close_m: np.ndarray, window: int, col_a: np.ndarray, col_b: np.ndarray,
+                                     processes: int = None, pool_class=ProcessPool, decimals: int = 2) -> np.ndarray:
+    """
+    The same calculation as correlation.window_correlation.pair_window_correlation, with the windows calculated
+    by a pool of worker processes.
+
+    The log prices and the pair columns are copied once into shared memory and the result is written by the
+    workers into a preallocated shared array. Each worker attaches to the shared arrays once, when it starts
+    (the pool initializer), so the tasks only pass a window index and nothing is pickled for the prices or
+    the results.
+
+    :param processes: the number of worker processes (the default is the number of CPUs)
+    :param pool_class: the pool class (e.g., pathos.multiprocessing.Pool). It must support the initializer and
+                       initargs arguments.
+    :return: the correlation (windows x pairs)
+    """
+    used_cols_a, pair_cols_a = np.unique(np.concatenate([col_a, col_b]), return_inverse=True)
+    shared_dict: Dict[str, SharedArray] = dict()
+    try:
+        shared_dict['log_prices'] = SharedArray.from_array(log_prices(np.asarray(close_m)[:, used_cols_a]))
+        shared_dict['pair_a'] = SharedArray.from_array(pair_cols_a[:len(col_a)])
+        shared_dict['pair_b'] = SharedArray.from_array(pair_cols_a[len(col_a):])
+        num_windows = len(range(0, close_m.shape[0], window))
+        shared_dict['corr'] = SharedArray.create((num_windows, len(col_a)), 'float64')
+        spec_dict = {key: shared_array.spec() for key, shared_array in shared_dict.items()}
+        params = {'window': window, 'decimals': decimals}
+        with pool_class(processes, initializer=attach_worker_arrays, initargs=(spec_dict, params)) as mp_pool:
+            mp_pool.map(window_correlation_task, range(num_windows))
+            # let the workers exit normally (rather than being terminated), so they close their shared memory
+            # handles
+            mp_pool.close()
+            mp_pool.join()
+        corr_m = shared_dict['corr'].array.copy()
+    finally:
+        for shared_array in shared_dict.values():
+            shared_array.close()
+    return corr_m
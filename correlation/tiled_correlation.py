@@ -0,0 +1,151 @@
+
+import os
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from correlation.normalize import normalize_columns
+from pairs.pairs import PairUniverse
+from read_market_data.price_matrix import ClosePriceMatrix
+
+
+def condensed_index(row_a, col_a, num_syms: int):
+    """
+    :return: the index in the condensed upper triangle (the pairs (i, j) with i < j in row order) for the
+             symbol indexes row_a < col_a
+    """
+    row_a = np.asarray(row_a, dtype='int64')
+    col_a = np.asarray(col_a, dtype='int64')
+    return row_a * num_syms - (row_a * (row_a + 1)) // 2 + (col_a - row_a - 1)
+
+
+class TiledCorrelationStore:
+    """
+    The all-pairs windowed correlation on disk. The correlation of the log close prices for every pair of
+    symbols is calculated for each window (the windows used by SerialCorrelation) and the upper triangle of
+    each window's correlation matrix is stored as a row of a (windows x pairs) float32 .npy file.
+
+    The correlation is calculated in tiles of block_size x block_size symbols, so the memory is bounded by the
+    window of prices and one tile. The stored matrix is memory mapped when it is read, so a window (a row) or
+    a set of pairs (columns) is read without loading the whole matrix. The size of the universe is limited by
+    the disk rather than the memory.
+
+    Files, where <name> is the store name:
+      <name>.npy         - the float32 correlation matrix (windows x pairs)
+      <name>_dates.npy   - the start date of each window
+      <name>_symbols.csv - the symbol table. The pair (i, j), i < j, is column condensed_index(i, j).
+    """
+
+    def __init__(self, path: str, name: str = 'pair_correlation'):
+        self.path = path
+        self.name = name
+        self.corr_file_path = path + os.path.sep + name + '.npy'
+        self.dates_file_path = path + os.path.sep + name + '_dates.npy'
+        self.symbols_file_path = path + os.path.sep + name + '_symbols.csv'
+        self.corr_m: np.ndarray = np.zeros((0, 0), dtype='float32')
+        self.index: pd.DatetimeIndex = pd.DatetimeIndex([])
+        self.symbols: List[str] = list()
+        self.sym_ix: dict = dict()
+
+    def has_files(self) -> bool:
+        return os.access(self.corr_file_path, os.R_OK) and \
+               os.access(self.dates_file_path, os.R_OK) and \
+               os.access(self.symbols_file_path, os.R_OK)
+
+    def build(self, close_matrix: ClosePriceMatrix, window: int, block_size: int = 512) -> None:
+        """
+        Calculate the windowed correlation for all of the pairs in the (memory mapped) close price matrix
+        and write it to the store. The correlation is rounded to two decimals, as in SerialCorrelation. The
+        correlation is NaN for a pair unless both stocks have prices for the whole window.
+
+        :param close_matrix: an open ClosePriceMatrix
+        :param window: the number of rows in each window
+        :param block_size: the number of symbols in a tile
+        """
+        if not os.access(self.path, os.R_OK):
+            os.makedirs(self.path)
+        num_rows, num_syms = close_matrix.shape()
+        window_start_l = list(range(0, num_rows, window))
+        num_pairs = (num_syms * (num_syms - 1)) // 2
+        corr_m = np.lib.format.open_memmap(self.corr_file_path, mode='w+', dtype='float32',
+                                           shape=(len(window_start_l), num_pairs))
+        for win_ix, window_start in enumerate(window_start_l):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                log_m = np.log(np.asarray(close_matrix.prices[window_start:window_start + window], dtype='float64'))
+            norm_m = normalize_columns(log_m)
+            for block_a in range(0, num_syms, block_size):
+                end_a = min(block_a + block_size, num_syms)
+                for block_b in range(block_a, num_syms, block_size):
+                    end_b = min(block_b + block_size, num_syms)
+                    tile_m = np.round(norm_m[:, block_a:end_a].T @ norm_m[:, block_b:end_b], 2)
+                    # each row of the tile is a contiguous run of the condensed upper triangle
+                    for row in range(block_a, end_a):
+                        col_start = max(block_b, row + 1)
+                        if col_start < end_b:
+                            k = int(condensed_index(row, col_start, num_syms))
+                            corr_m[win_ix, k:k + end_b - col_start] = tile_m[row - block_a, col_start - block_b:]
+        corr_m.flush()
+        del corr_m
+        np.save(self.dates_file_path, np.array(close_matrix.index.values[window_start_l], dtype='datetime64[ns]'))
+        pd.DataFrame(list(close_matrix.symbols), columns=['symbol']).to_csv(self.symbols_file_path, index=False)
+
+    def open(self) -> None:
+        """
+        Memory map the correlation matrix (read only) and read the date and symbol sidecars.
+        """
+        self.corr_m = np.load(self.corr_file_path, mmap_mode='r')
+        self.index = pd.DatetimeIndex(np.load(self.dates_file_path).astype('datetime64[ns]'))
+        symbols_df = pd.read_csv(self.symbols_file_path, keep_default_na=False)
+        self.symbols = list(symbols_df['symbol'])
+        self.sym_ix = {sym: ix for ix, sym in enumerate(self.symbols)}
+
+    def pair_columns(self, pairs: PairUniverse) -> np.ndarray:
+        """
+        :return: the stored column for each pair in the universe (the order of the stocks in a pair does not matter)
+        """
+        col_a, col_b = pairs.column_index(self.symbols)
+        return condensed_index(np.minimum(col_a, col_b), np.maximum(col_a, col_b), len(self.symbols))
+
+    @staticmethod
+    def decode(corr_m: np.ndarray) -> np.ndarray:
+        # the values were rounded to two decimals before they were stored as float32
+        return np.round(corr_m.astype('float64'), 2)
+
+    def window_values(self, window_ix: int) -> np.ndarray:
+        """
+        :return: the condensed upper triangle for a window
+        """
+        return self.decode(self.corr_m[window_ix])
+
+    def window_matrix(self, window_ix: int) -> np.ndarray:
+        """
+        :return: the full (symbols x symbols) correlation matrix for a window, with 1.0 on the diagonal
+        """
+        num_syms = len(self.symbols)
+        row_a, col_a = np.triu_indices(num_syms, k=1)
+        corr_m = np.eye(num_syms)
+        corr_m[row_a, col_a] = self.window_values(window_ix)
+        corr_m[col_a, row_a] = corr_m[row_a, col_a]
+        return corr_m
+
+    def pair_series(self, sym_a: str, sym_b: str) -> pd.Series:
+        """
+        :return: the windowed correlation for one pair
+        """
+        row, col = sorted((self.sym_ix[sym_a], self.sym_ix[sym_b]))
+        k = int(condensed_index(row, col, len(self.symbols)))
+        return pd.Series(self.decode(self.corr_m[:, k]), index=self.index, name=f'{sym_a}:{sym_b}')
+
+    def pairs_frame(self, pairs: PairUniverse, window_range: Tuple[int, int] = None) -> pd.DataFrame:
+        """
+        Read the windowed correlation for a set of pairs. The result has the same layout as the result of
+        SerialCorrelation.serial_correlation (the index is the window start date and the columns are the pairs).
+
+        :param window_range: an optional [start, end) range of windows
+        """
+        start_ix, end_ix = window_range if window_range is not None else (0, self.corr_m.shape[0])
+        columns_a = self.pair_columns(pairs)
+        corr_df = pd.DataFrame(self.decode(self.corr_m[start_ix:end_ix][:, columns_a]), columns=pairs.pair_strs())
+        corr_df.index = self.index[start_ix:end_ix]
+        return corr_df
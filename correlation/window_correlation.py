@@ -0,0 +1,103 @@
+
+import numpy as np
+
+from correlation.normalize import normalize_columns
+
+
+def log_prices(close_m: np.ndarray) -> np.ndarray:
+    """
+    :return: the log of the close prices. Missing prices (NaN) stay NaN.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log(np.asarray(close_m, dtype='float64'))
+
+
+def pair_window_correlation(close_m: np.ndarray, window: int, col_a: np.ndarray, col_b: np.ndarray,
+                            decimals: int = 2) -> np.ndarray:
+    """
+    The correlation of the log close prices for a set of pairs, over the windows [0, window), [window, 2 * window), ...
+    (the last window may be shorter). This is the calculation in SerialCorrelation.calc_pair_serial_correlation
+    for all of the pairs at once.
+
+    The log prices are calculated once. For each window, the log price columns are normalized and the
+    symbol x symbol correlation matrix is a single matrix product. The pair correlations are gathered from
+    that matrix. Only the symbols that are in a pair are included in the product.
+
+    :param close_m: the close prices (dates x symbols). Missing prices are NaN.
+    :param window: the number of rows in a window
+    :param col_a: the column of stock A for each pair
+    :param col_b: the column of stock B for each pair
+    :param decimals: the correlation is rounded to this number of decimals
+    :return: the correlation (windows x pairs). The correlation is NaN unless both stocks have prices for
+             the whole window.
+    """
+    used_cols_a, pair_cols_a = np.unique(np.concatenate([col_a, col_b]), return_inverse=True)
+    pair_a = pair_cols_a[:len(col_a)]
+    pair_b = pair_cols_a[len(col_a):]
+    log_m = log_prices(np.asarray(close_m)[:, used_cols_a])
+    window_start_a = np.arange(0, log_m.shape[0], window)
+    corr_m = np.zeros((window_start_a.shape[0], len(col_a)))
+    for win_ix, window_start in enumerate(window_start_a):
+        norm_m = normalize_columns(log_m[window_start:window_start + window])
+        sym_corr_m = norm_m.T @ norm_m
+        corr_m[win_ix] = sym_corr_m[pair_a, pair_b]
+    return np.round(corr_m, decimals)
+
+
+def pair_sliding_correlation(close_m: np.ndarray, window: int, col_a: np.ndarray, col_b: np.ndarray,
+                             stride: int = 1, decimals: int = 2) -> np.ndarray:
+    """
+    The correlation of the log close prices for a set of pairs over sliding windows [start, start + window),
+    where start = 0, stride, 2 * stride, ... Only full windows are included.
+
+    The correlation is calculated from running sums (sum x, sum y, sum x^2, sum y^2 and sum x * y) that are
+    updated by adding the new day and dropping the oldest day, so each step costs the same for any window
+    length. The per-symbol sums are shared by all of the pairs with that symbol. The log prices are centered
+    on their column mean (which does not change the correlation) and the sums are recalculated exactly at
+    every window length, to bound the rounding error of the updates.
+
+    :param close_m: the close prices (dates x symbols). Missing prices are NaN.
+    :param window: the number of rows in a window
+    :param col_a: the column of stock A for each pair
+    :param col_b: the column of stock B for each pair
+    :param stride: the number of rows between window starts
+    :param decimals: the correlation is rounded to this number of decimals
+    :return: the correlation (windows x pairs). The correlation is NaN unless both stocks have prices for
+             the whole window.
+    """
+    used_cols_a, pair_cols_a = np.unique(np.concatenate([col_a, col_b]), return_inverse=True)
+    pair_a = pair_cols_a[:len(col_a)]
+    pair_b = pair_cols_a[len(col_a):]
+    log_m = log_prices(np.asarray(close_m)[:, used_cols_a])
+    missing_m = np.isnan(log_m)
+    x_m = np.where(missing_m, 0.0, log_m)
+    col_mean_a = x_m.sum(axis=0) / np.maximum((~missing_m).sum(axis=0), 1)
+    x_m = np.where(missing_m, 0.0, x_m - col_mean_a)
+    window_start_a = np.arange(0, log_m.shape[0] - window + 1, stride)
+    corr_m = np.zeros((window_start_a.shape[0], len(col_a)))
+    sum_x = sum_xx = sum_xy = num_missing = None
+    out_ix = 0
+    for start in range(0, log_m.shape[0] - window + 1):
+        if start % window == 0:
+            window_m = x_m[start:start + window]
+            sum_x = window_m.sum(axis=0)
+            sum_xx = np.sum(window_m * window_m, axis=0)
+            sum_xy = np.sum(window_m[:, pair_a] * window_m[:, pair_b], axis=0)
+            num_missing = missing_m[start:start + window].sum(axis=0)
+        else:
+            drop_a = x_m[start - 1]
+            add_a = x_m[start + window - 1]
+            sum_x += add_a - drop_a
+            sum_xx += add_a * add_a - drop_a * drop_a
+            sum_xy += add_a[pair_a] * add_a[pair_b] - drop_a[pair_a] * drop_a[pair_b]
+            num_missing += missing_m[start + window - 1].astype('int64') - missing_m[start - 1]
+        if start % stride == 0:
+            var_a = sum_xx - sum_x * sum_x / window
+            cov_a = sum_xy - sum_x[pair_a] * sum_x[pair_b] / window
+            with np.errstate(divide='ignore', invalid='ignore'):
+                corr_a = cov_a / np.sqrt(var_a[pair_a] * var_a[pair_b])
+            valid_a = (num_missing[pair_a] == 0) & (num_missing[pair_b] == 0) & \
+                      (var_a[pair_a] > 0) & (var_a[pair_b] > 0)
+            corr_m[out_ix] = np.where(valid_a, corr_a, np.nan)
+            out_ix += 1
+    return np.round(corr_m, decimals)
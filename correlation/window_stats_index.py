@@ -0,0 +1,128 @@
+
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from correlation.window_correlation import log_prices
+
+
+class WindowStatsIndex:
+    """
+    Prefix sums (cumulative sums from the first row) of the prices and the squared prices for each symbol and,
+    when a pair is first queried, of the pair cross-product. The sum over any row range [start_ix, end_ix)
+    is the difference of two prefix sums, so the mean, variance, correlation and OLS slope/intercept for a
+    pair over any window are calculated in O(1), without reading the window. One index serves any number of
+    window lengths (e.g., a quarter, a half year and a year).
+
+    The prices are centered on their column mean before they are summed, which keeps the sums small and
+    does not change the variance, correlation or slope. A statistic is NaN unless the stocks have prices for
+    the whole window.
+
+    The start and end of a window can be ints or arrays (the statistics are then calculated for each window).
+    """
+
+    def __init__(self, close_m: np.ndarray, symbols: List[str], log: bool = False):
+        """
+        :param close_m: the close prices (dates x symbols). Missing prices are NaN.
+        :param symbols: the symbols for the columns of close_m
+        :param log: if True, the index is for the log prices (as in SerialCorrelation)
+        """
+        self.symbols = list(symbols)
+        self.col_ix = {sym: ix for ix, sym in enumerate(self.symbols)}
+        price_m = log_prices(close_m) if log else np.asarray(close_m, dtype='float64')
+        missing_m = np.isnan(price_m)
+        price_m = np.where(missing_m, 0.0, price_m)
+        self.offset_a = price_m.sum(axis=0) / np.maximum((~missing_m).sum(axis=0), 1)
+        self.centered_m = np.where(missing_m, 0.0, price_m - self.offset_a)
+        num_rows = price_m.shape[0] + 1
+        self.count_m = np.zeros((num_rows, price_m.shape[1]), dtype='int64')
+        np.cumsum(~missing_m, axis=0, out=self.count_m[1:])
+        self.sum_m = np.zeros((num_rows, price_m.shape[1]))
+        np.cumsum(self.centered_m, axis=0, out=self.sum_m[1:])
+        self.sum_sq_m = np.zeros((num_rows, price_m.shape[1]))
+        np.cumsum(self.centered_m * self.centered_m, axis=0, out=self.sum_sq_m[1:])
+        # the pair cross-product prefix sums, calculated on demand
+        self.cross_dict: Dict[Tuple[int, int], np.ndarray] = dict()
+
+    @classmethod
+    def from_frame(cls, close_df: pd.DataFrame, log: bool = False):
+        return cls(close_df.values, list(close_df.columns), log=log)
+
+    def cross_sum(self, col_a: int, col_b: int) -> np.ndarray:
+        """
+        :return: the prefix sums of the cross-product of two columns (built on the first call for the pair)
+        """
+        key = (min(col_a, col_b), max(col_a, col_b))
+        if key not in self.cross_dict:
+            cross_a = np.zeros(self.centered_m.shape[0] + 1)
+            np.cumsum(self.centered_m[:, key[0]] * self.centered_m[:, key[1]], out=cross_a[1:])
+            self.cross_dict[key] = cross_a
+        return self.cross_dict[key]
+
+    def window_sums(self, sym: str, start_ix, end_ix) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        :return: the number of rows, the number of prices, the sum and the sum of squares (of the centered prices)
+                 for the window [start_ix, end_ix)
+        """
+        col = self.col_ix[sym]
+        start_ix = np.asarray(start_ix)
+        end_ix = np.asarray(end_ix)
+        num_rows = end_ix - start_ix
+        count = self.count_m[end_ix, col] - self.count_m[start_ix, col]
+        sum_x = self.sum_m[end_ix, col] - self.sum_m[start_ix, col]
+        sum_xx = self.sum_sq_m[end_ix, col] - self.sum_sq_m[start_ix, col]
+        return num_rows, count, sum_x, sum_xx
+
+    def mean(self, sym: str, start_ix, end_ix) -> Union[float, np.ndarray]:
+        num_rows, count, sum_x, _ = self.window_sums(sym, start_ix, end_ix)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count == num_rows, sum_x / num_rows + self.offset_a[self.col_ix[sym]], np.nan)
+        return mean[()]
+
+    def var(self, sym: str, start_ix, end_ix, ddof: int = 0) -> Union[float, np.ndarray]:
+        num_rows, count, sum_x, sum_xx = self.window_sums(sym, start_ix, end_ix)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            var = np.where(count == num_rows, (sum_xx - sum_x * sum_x / num_rows) / (num_rows - ddof), np.nan)
+        return var[()]
+
+    def pair_sums(self, sym_a: str, sym_b: str, start_ix, end_ix) -> Tuple:
+        """
+        :return: the number of rows, whether both stocks have prices for the whole window, the sum of A, the
+                 sum of B, the centered sum of squares of A and B and the centered sum of cross-products
+        """
+        num_rows, count_a, sum_a, sum_aa = self.window_sums(sym_a, start_ix, end_ix)
+        _, count_b, sum_b, sum_bb = self.window_sums(sym_b, start_ix, end_ix)
+        cross_a = self.cross_sum(self.col_ix[sym_a], self.col_ix[sym_b])
+        sum_ab = cross_a[np.asarray(end_ix)] - cross_a[np.asarray(start_ix)]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ss_a = sum_aa - sum_a * sum_a / num_rows
+            ss_b = sum_bb - sum_b * sum_b / num_rows
+            ss_ab = sum_ab - sum_a * sum_b / num_rows
+        valid = (count_a == num_rows) & (count_b == num_rows) & (num_rows > 0)
+        return num_rows, valid, sum_a, sum_b, ss_a, ss_b, ss_ab
+
+    def corr(self, sym_a: str, sym_b: str, start_ix, end_ix) -> Union[float, np.ndarray]:
+        """
+        :return: the correlation of the two stocks over the window [start_ix, end_ix)
+        """
+        _, valid, _, _, ss_a, ss_b, ss_ab = self.pair_sums(sym_a, sym_b, start_ix, end_ix)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.where(valid & (ss_a > 0) & (ss_b > 0), ss_ab / np.sqrt(ss_a * ss_b), np.nan)
+        return corr[()]
+
+    def ols(self, sym_y: str, sym_x: str, start_ix, end_ix) -> Tuple:
+        """
+        The OLS regression y = intercept + slope * x over the window [start_ix, end_ix) (as in
+        PairStatisticsBase.pair_regression, where y is stock A and x is stock B).
+
+        :return: the slope and the intercept
+        """
+        num_rows, valid, sum_y, sum_x, ss_y, ss_x, ss_xy = self.pair_sums(sym_y, sym_x, start_ix, end_ix)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            valid = valid & (ss_x > 0)
+            slope = np.where(valid, ss_xy / ss_x, np.nan)
+            mean_y = sum_y / num_rows + self.offset_a[self.col_ix[sym_y]]
+            mean_x = sum_x / num_rows + self.offset_a[self.col_ix[sym_x]]
+            intercept = np.where(valid, mean_y - slope * mean_x, np.nan)
+        return slope[()], intercept[()]
@@ -1,7 +1,175 @@
-from typing import List, Tuple
+from typing import List, Tuple, Iterator
 
+import numpy as np
 
-def get_pairs(sector_info: dict) -> List[Tuple]:
+
+class PairUniverse:
+    """
+    A compact table of stock pairs. The pairs are stored as two int32 arrays of indexes into a shared symbol
+    table and an array of sector codes (indexes into the sector table), rather than as a list of string tuples.
+    For a universe of 3000 symbols this is a few MB, instead of hundreds of MB of tuples.
+
+    The symbol strings are only rendered when they are needed (e.g., for output). Indexing the universe
+    returns a (stock_a, stock_b, sector) tuple, so the universe can be used where a list of pair tuples was
+    used before.
+    """
+
+    def __init__(self, symbols: List[str], sectors: List[str], index_a: np.ndarray, index_b: np.ndarray,
+                 sector_code: np.ndarray):
+        """
+        :param symbols: the symbol table
+        :param sectors: the sector table
+        :param index_a: the symbol index of stock A for each pair
+        :param index_b: the symbol index of stock B for each pair
+        :param sector_code: the sector index for each pair
+        """
+        self.symbols = symbols
+        self.sectors = sectors
+        self.sym_ix = {sym: ix for ix, sym in enumerate(symbols)}
+        self.index_a = np.asarray(index_a, dtype='int32')
+        self.index_b = np.asarray(index_b, dtype='int32')
+        self.sector_code = np.asarray(sector_code, dtype='int16')
+
+    @classmethod
+    def from_sectors(cls, sector_info: dict):
+        """
+        Build the universe of all of the pairs within each sector.
+
+        :param sector_info: a dictionary of sector -> list of stocks in the sector
+        """
+        sectors = list(sector_info.keys())
+        symbols: List[str] = list()
+        sym_ix = dict()
+        index_a_l = list()
+        index_b_l = list()
+        sector_code_l = list()
+        for sector_code, sector in enumerate(sectors):
+            stock_ix_l = list()
+            for sym in sector_info[sector]:
+                if sym not in sym_ix:
+                    sym_ix[sym] = len(symbols)
+                    symbols.append(sym)
+                stock_ix_l.append(sym_ix[sym])
+            stock_ix_a = np.array(stock_ix_l, dtype='int32')
+            row_ix, col_ix = np.triu_indices(stock_ix_a.shape[0], k=1)
+            index_a_l.append(stock_ix_a[row_ix])
+            index_b_l.append(stock_ix_a[col_ix])
+            sector_code_l.append(np.full(row_ix.shape[0], sector_code, dtype='int16'))
+        index_a = np.concatenate(index_a_l) if len(index_a_l) > 0 else np.zeros(0, dtype='int32')
+        index_b = np.concatenate(index_b_l) if len(index_b_l) > 0 else np.zeros(0, dtype='int32')
+        sector_code = np.concatenate(sector_code_l) if len(sector_code_l) > 0 else np.zeros(0, dtype='int16')
+        return cls(symbols, sectors, index_a, index_b, sector_code)
+
+    @classmethod
+    def from_pair_strs(cls, pair_str_l: List[str]):
+        """
+        Build a universe from the string representation of the pairs (e.g., the column names of a pairs data
+        frame that was read from a file). The pairs do not have a sector.
+
+        :param pair_str_l: a list of pair strings, 'A:B'
+        """
+        symbols: List[str] = list()
+        sym_ix = dict()
+        index_m = np.zeros((len(pair_str_l), 2), dtype='int32')
+        for pair_ix, pair_str in enumerate(pair_str_l):
+            for sym_col, sym in enumerate(pair_str.split(':')):
+                if sym not in sym_ix:
+                    sym_ix[sym] = len(symbols)
+                    symbols.append(sym)
+                index_m[pair_ix, sym_col] = sym_ix[sym]
+        return cls(symbols, [''], index_m[:, 0], index_m[:, 1], np.zeros(len(pair_str_l), dtype='int16'))
+
+    def __len__(self) -> int:
+        return self.index_a.shape[0]
+
+    def __getitem__(self, ix: int) -> Tuple[str, str, str]:
+        return self.symbols[self.index_a[ix]], self.symbols[self.index_b[ix]], self.sectors[self.sector_code[ix]]
+
+    def __iter__(self) -> Iterator[Tuple[str, str, str]]:
+        for ix in range(len(self)):
+            yield self[ix]
+
+    def pair_str(self, ix: int) -> str:
+        """
+        :return: the string representation of the pair, 'A:B'
+        """
+        return f'{self.symbols[self.index_a[ix]]}:{self.symbols[self.index_b[ix]]}'
+
+    def pair_strs(self) -> List[str]:
+        return [self.pair_str(ix) for ix in range(len(self))]
+
+    def select(self, selection: np.ndarray):
+        """
+        :param selection: a boolean mask or an array of pair indexes
+        :return: a PairUniverse with the selected pairs, which shares the symbol and sector tables
+        """
+        return PairUniverse(self.symbols, self.sectors, self.index_a[selection], self.index_b[selection],
+                            self.sector_code[selection])
+
+    def sector_shard(self, sector: str):
+        """
+        :return: the pairs in a sector. No statistic crosses sectors, so each sector shard can be analyzed
+                 independently and the shard results merged (in sector order) into the results for the universe.
+        """
+        return self.select(self.sector_code == self.sectors.index(sector))
+
+    def symbol_mask(self, symbols) -> np.ndarray:
+        """
+        :param symbols: a collection of symbols
+        :return: a boolean vector over the symbol table that is True for the symbols in the collection
+        """
+        mask_a = np.zeros(len(self.symbols), dtype=bool)
+        mask_a[[self.sym_ix[sym] for sym in symbols if sym in self.sym_ix]] = True
+        return mask_a
+
+    def eligible_pairs(self, symbols):
+        """
+        :return: the pairs where both stocks are in the symbols collection
+        """
+        mask_a = self.symbol_mask(symbols)
+        return self.select(mask_a[self.index_a] & mask_a[self.index_b])
+
+    def merge(self, other):
+        """
+        Merge the pairs of another universe into this universe. The symbol and sector tables are combined and
+        a pair that is in both universes (in either order) is kept once, with the sector from this universe.
+
+        :return: a new PairUniverse
+        """
+        symbols = list(self.symbols)
+        sym_ix = dict(self.sym_ix)
+        for sym in other.symbols:
+            if sym not in sym_ix:
+                sym_ix[sym] = len(symbols)
+                symbols.append(sym)
+        sectors = list(self.sectors)
+        for sector in other.sectors:
+            if sector not in sectors:
+                sectors.append(sector)
+        other_sym_a = np.array([sym_ix[sym] for sym in other.symbols], dtype='int32')
+        other_sector_a = np.array([sectors.index(sector) for sector in other.sectors], dtype='int16')
+        index_a = np.concatenate([self.index_a, other_sym_a[other.index_a]])
+        index_b = np.concatenate([self.index_b, other_sym_a[other.index_b]])
+        sector_code = np.concatenate([self.sector_code, other_sector_a[other.sector_code]])
+        # an unordered pair key, so (A, B) and (B, A) are the same pair
+        pair_key = np.minimum(index_a, index_b).astype('int64') * len(symbols) + np.maximum(index_a, index_b)
+        _, first_ix = np.unique(pair_key, return_index=True)
+        first_ix.sort()
+        return PairUniverse(symbols, sectors, index_a[first_ix], index_b[first_ix], sector_code[first_ix])
+
+    def column_index(self, columns: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Map the pairs onto the columns of a price matrix (which may have a different symbol order).
+
+        :param columns: the symbols for the price matrix columns. All of the pair symbols must be in the columns.
+        :return: the column indexes for stock A and stock B
+        """
+        col_ix = {sym: ix for ix, sym in enumerate(columns)}
+        table_col_a = np.array([col_ix[sym] for sym in self.symbols], dtype='int32')
+        return table_col_a[self.index_a], table_col_a[self.index_b]
+
+
+def get_pairs(sector_info: dict) -> PairUniverse:
     """
     Return the sector stock pairs, where the pairs are selected from the S&P 500 sector.
 
@@ -10,7 +178,7 @@ def get_pairs(sector_info: dict) -> List[Tuple]:
                        Here 'energies' is the dictionary key for the S&P 500 sector. The dictionary value is the
                        list of stocks in the sector.
 
-    :return: A list of Tuples, where each tuple contains the symbols for the stock pair and the sector.
+    :return: A PairUniverse. Each element is a tuple that contains the symbols for the stock pair and the sector.
             For example:
               [('AAPL', 'ACN', 'information-technology'),
                ('AAPL', 'ADBE', 'information-technology'),
@@ -18,14 +186,4 @@ def get_pairs(sector_info: dict) -> List[Tuple]:
                ('AAPL', 'ADP', 'information-technology'),
                ('AAPL', 'ADSK', 'information-technology')]
     """
-    pairs_list = list()
-    sectors = list(sector_info.keys())
-    for sector in sectors:
-        stocks = sector_info[sector]
-        num_stocks = len(stocks)
-        for i in range(num_stocks):
-            stock_a = stocks[i]
-            for j in range(i + 1, num_stocks):
-                stock_b = stocks[j]
-                pairs_list.append((stock_a, stock_b, sector))
-    return pairs_list
+    return PairUniverse.from_sectors(sector_info)
@@ -174,7 +174,8 @@ d2008_start_date: datetime = datetime.fromisoformat(d2008_date_str)
 apple_tuple: Tuple = ('AAPL', 'MPWR')
 market_data = MarketData(start_date=start_date, path=s_and_p_data)
 
-close_prices_df = market_data.get_close_data(['AAPL', 'MPWR', 'YUM'])
+# Only the 2007 rows for the three stocks are read from the price store
+close_prices_df = market_data.get_close_data(['AAPL', 'MPWR', 'YUM'], start_date=start_date, end_date=d2008_start_date)
 close_index = close_prices_df.index
 
 half_year = int(trading_days/2)
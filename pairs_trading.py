@@ -237,12 +237,20 @@ from tabulate import tabulate
 
 from coint_analysis.coint_analysis_result import CointAnalysisResult, CointInfo
 from coint_data_io.coint_matrix_io import CointMatrixIO
-from pairs.pairs import get_pairs
+from correlation.parallel_correlation import parallel_pair_window_correlation
+from correlation.tiled_correlation import TiledCorrelationStore
+from correlation.window_correlation import pair_window_correlation, pair_sliding_correlation
+from correlation.window_stats_index import WindowStatsIndex
+from pairs.pairs import get_pairs, PairUniverse
 #
 # Local libraries
 #
 from plot_ts.plot_time_series import plot_ts, plot_two_ts
-from read_market_data.MarketData import MarketData, read_s_and_p_stock_info, extract_sectors
+from read_market_data.MarketData import MarketData
+from read_market_data.derived_bars import BarTimeframe
+from read_market_data.panel_cache import PanelCache
+from read_market_data.price_matrix import ClosePriceMatrix
+from read_market_data.validity_mask import ValidityMask
 
 # Apply the default theme
 sns.set_theme()
@@ -289,22 +297,15 @@ def calc_pair_counts(sector_info: dict) -> pd.DataFrame:
     return info_df
 
 
-# stock_info_df: a DataFrame with columns Symbol, Name, Sector
-stock_info_df = read_s_and_p_stock_info(s_and_p_file)
-stock_l: list = list(set(stock_info_df['Symbol']))
-stock_l.sort()
 market_data = MarketData(start_date=start_date)
+panel_cache = PanelCache(market_data)
 
-# Get close prices for the S&P 500 list
-close_prices_df = market_data.get_close_data(stock_l)
-final_stock_list = list(close_prices_df.columns)
-mask = stock_info_df['Symbol'].isin(final_stock_list)
-# Some stocks were listed on the stock exchange later than start_date. In this case the stock will not
-# be returned by MarketData.get_close_data(). final_stock_info has the Symbol, Name, Sector for the
-# set of stocks that it was possible to obtain close prices for the date range.
-final_stock_info_df = stock_info_df[mask]
+# Get close prices for the S&P 500 list. Some stocks were listed on the stock exchange later than start_date.
+# In this case the stock will not be returned by MarketData.get_close_data(). final_stock_info_df has the
+# Symbol, Name, Sector (columns) for the set of stocks that it was possible to obtain close prices for the
+# date range. The panel is loaded from the panel cache if the source data has not changed.
+close_prices_df, final_stock_info_df, sectors = panel_cache.get_panel(s_and_p_file)
 
-sectors = extract_sectors(final_stock_info_df)
 pairs_info_df = calc_pair_counts(sectors)
 
 # -
@@ -866,11 +867,20 @@ class SerialCorrelation:
             self.pair: Tuple = pair
             self.corr_df: pd.DataFrame = corr_df
 
-    def __init__(self, stock_close_df: pd.DataFrame, pairs_list: List[Tuple], window: int):
+    def __init__(self, stock_close_df: pd.DataFrame, pairs_list: PairUniverse, window: int, stride: int = None):
+        """
+        :param stride: if None, the windows do not overlap (a new window starts every window days). Otherwise
+                       the windows slide, with a new window starting every stride days (e.g., 1 for daily
+                       windows). Only full windows are included when the windows slide.
+        """
         self.stock_close_df = stock_close_df
         self.pairs_list = pairs_list
         self.window = window
+        self.stride = stride
         self.index = self.stock_close_df.index
+        # If the stocks have ragged histories, the correlation for a window is NaN unless both stocks
+        # have prices for the whole window
+        self.validity = ValidityMask.from_frame(stock_close_df)
 
     def calc_pair_serial_correlation(self, pair) -> SerialCorrResult:
         stock_a_sym = pair[0]
@@ -880,10 +890,12 @@ class SerialCorrelation:
         corr_list = list()
         date_list = list()
         for ix in range(0, self.stock_close_df.shape[0], self.window):
-            stock_a_win = log(stock_a_df.iloc[ix:ix + self.window])
-            stock_b_win = log(stock_b_df.iloc[ix:ix + self.window])
-            c = np.corrcoef(stock_a_win, stock_b_win)
-            corr =  round(c[0, 1], 2)
+            corr = np.NAN
+            if self.validity.pair_eligible(stock_a_sym, stock_b_sym, ix, ix + self.window):
+                stock_a_win = log(stock_a_df.iloc[ix:ix + self.window])
+                stock_b_win = log(stock_b_df.iloc[ix:ix + self.window])
+                c = np.corrcoef(stock_a_win, stock_b_win)
+                corr =  round(c[0, 1], 2)
             corr_list.append(corr)
             date_list.append(self.index[ix])
         corr_df = pd.DataFrame(corr_list)
@@ -892,31 +904,40 @@ class SerialCorrelation:
         return serial_corr_result
 
     def build_corr_frame(self, corr_list: List[SerialCorrResult]) -> pd.DataFrame:
-        num_cols = len(corr_list)
-        num_rows = corr_list[0].corr_df.shape[0]
-        corr_m = np.zeros([num_rows, num_cols])
-        col_names = list()
-        for col_ix in range(num_cols):
-            pair = corr_list[col_ix].pair
-            col = f'{pair[0]}:{pair[1]}'
-            col_names.append(col)
-            corr_df = corr_list[col_ix].corr_df
-            for row_ix in range(num_rows):
-                corr_m[row_ix, col_ix] = corr_df.iloc[row_ix]
+        # each result is a one column DataFrame, so the results are the columns of the correlation matrix
+        corr_m = np.column_stack([corr_result.corr_df.values[:, 0] for corr_result in corr_list])
+        col_names = [f'{corr_result.pair[0]}:{corr_result.pair[1]}' for corr_result in corr_list]
         corr_df = pd.DataFrame(corr_m)
         corr_df.columns = col_names
         corr_df.index = corr_list[0].corr_df.index
         return corr_df
 
 
-    def serial_correlation(self) -> pd.DataFrame:
-        # serial_corr_list = list()
-        # for pair in self.pairs_list:
-        #     serial_corr = self.calc_pair_serial_correlation(pair)
-        #     serial_corr_list.append(serial_corr)
-        with Pool() as mp_pool:
-            serial_corr_list = mp_pool.map(self.calc_pair_serial_correlation, self.pairs_list)
-        corr_df = self.build_corr_frame(serial_corr_list)
+    def serial_correlation(self, processes: int = None) -> pd.DataFrame:
+        """
+        Calculate the windowed correlation for all of the pairs. The result is the same as calling
+        calc_pair_serial_correlation for each pair (with build_corr_frame), but the log prices are calculated
+        once and the correlation for all of the pairs in a window comes from one matrix product.
+
+        :param processes: if not None, the (non-overlapping) windows are calculated by a pool of this many
+                          worker processes. The workers read the prices from shared memory and write the
+                          correlation into a shared output array.
+        :return: a DataFrame where the index is the window start date and the columns are the pairs
+        """
+        col_a, col_b = self.pairs_list.column_index(list(self.stock_close_df.columns))
+        if self.stride is None and processes is not None:
+            corr_m = parallel_pair_window_correlation(self.stock_close_df.values, self.window, col_a, col_b,
+                                                      processes=processes, pool_class=Pool)
+            window_start_index = self.index[0::self.window]
+        elif self.stride is None:
+            corr_m = pair_window_correlation(self.stock_close_df.values, self.window, col_a, col_b)
+            window_start_index = self.index[0::self.window]
+        else:
+            corr_m = pair_sliding_correlation(self.stock_close_df.values, self.window, col_a, col_b, self.stride)
+            window_start_index = self.index[0:self.index.shape[0] - self.window + 1:self.stride]
+        corr_df = pd.DataFrame(corr_m)
+        corr_df.columns = self.pairs_list.pair_strs()
+        corr_df.index = window_start_index
         return corr_df
 
 
@@ -950,6 +971,60 @@ plot_ts(data_s=apple_corr_df[0], title=f'correlation between {apple_tuple[0]} an
 
 # -
 
+# <p>
+# The same analysis can be run on weekly (or monthly) close prices. The weekly bars are read from a cache that is derived from
+# the daily prices and updated as new days are added, so the daily prices are not resampled each time the notebook runs.
+# A six month window is 26 weeks.
+# </p>
+
+# +
+
+weekly_close_df = market_data.get_bar_close_data(list(close_prices_df.columns), BarTimeframe.WEEKLY, refresh=False)
+weekly_serial_correlation = SerialCorrelation(weekly_close_df, pairs_list, 26)
+apple_weekly_corr_df = weekly_serial_correlation.calc_pair_serial_correlation(apple_tuple).corr_df
+
+plot_ts(data_s=apple_weekly_corr_df[0], title=f'correlation between {apple_tuple[0]} and {apple_tuple[1]} (weekly)',
+        x_label='Window Start Date', y_label=f'Correlation over 26 week window')
+
+# -
+
+# <p>
+# The windows above do not overlap, so there is one correlation value per half year. With sliding windows that start every
+# day, the correlation history has a daily resolution. The sliding correlation is updated as each day is added to (and the
+# oldest day is dropped from) the window, so it costs about the same as the non-overlapping windows.
+# </p>
+
+# +
+
+apple_pair = PairUniverse.from_pair_strs([f'{apple_tuple[0]}:{apple_tuple[1]}'])
+apple_sliding_corr_df = SerialCorrelation(close_prices_df, apple_pair, half_year, stride=1).serial_correlation()
+
+plot_ts(data_s=apple_sliding_corr_df[apple_pair.pair_str(0)],
+        title=f'correlation between {apple_tuple[0]} and {apple_tuple[1]} (daily sliding window)',
+        x_label='Window Start Date', y_label=f'Correlation over {half_year} day window')
+
+# -
+
+# <p>
+# The correlation and the regression for other window lengths (e.g., a quarter or a year) are calculated from an index of
+# cumulative sums of the prices, the squared prices and the pair cross-products. The sums for any window are the difference of
+# two cumulative sums, so one index is used for all of the window lengths and nothing is recalculated for a new window length.
+# </p>
+
+# +
+
+window_stats_index = WindowStatsIndex.from_frame(close_prices_df, log=True)
+window_length_corr_l = list()
+for window_length in [trading_days // 4, half_year, trading_days]:
+    window_start_a = np.arange(0, close_prices_df.shape[0] - window_length + 1, window_length)
+    window_corr_a = window_stats_index.corr(apple_tuple[0], apple_tuple[1], window_start_a, window_start_a + window_length)
+    window_length_corr_l.append(pd.Series(np.round(window_corr_a, 2), index=close_prices_df.index[window_start_a],
+                                          name=f'{window_length} days'))
+window_length_corr_df = pd.concat(window_length_corr_l, axis=1)
+print(tabulate(window_length_corr_df, headers=[*window_length_corr_df.columns], tablefmt='fancy_grid'))
+
+# -
+
 # <p>
 # Since correlation is not stable, a stock pair that is highly correlated in one time period may be uncorrelated (or negatively
 # correlated) in the next time period.
@@ -963,14 +1038,31 @@ corr_df = serial_correlation.serial_correlation()
 
 
 def calc_corr_dist(corr_df: pd.DataFrame, cut_off: float) -> pd.DataFrame:
-    count_list = list()
-    for row_num, row in corr_df.iterrows():
-        count = 0
-        for val in row:
-            if val >= cut_off:
-                count = count + 1
-        count_list.append(count)
-    count_df = pd.DataFrame(count_list)
+    """
+    :return: the number of pairs in each time period with a correlation >= cut_off (NaN values are not counted)
+    """
+    count_df = pd.DataFrame(np.sum(corr_df.values >= cut_off, axis=1))
+    count_df.index = corr_df.index
+    return count_df
+
+
+def calc_corr_dist_cutoffs(corr_df: pd.DataFrame, cut_offs: List[float]) -> pd.DataFrame:
+    """
+    Count the pairs with a correlation >= each cutoff in one pass. Each row is sorted once and the count for
+    every cutoff is found with a binary search, so exploring cutoff values does not re-scan the correlation
+    values for each cutoff.
+
+    :return: a DataFrame with the number of pairs in each time period (rows) for each cutoff (columns)
+    """
+    # NaN values are sorted to the end of the row
+    sorted_m = np.sort(corr_df.values, axis=1)
+    num_valid_a = np.sum(~np.isnan(sorted_m), axis=1)
+    cut_off_a = np.asarray(cut_offs, dtype='float64')
+    count_m = np.zeros((sorted_m.shape[0], cut_off_a.shape[0]), dtype='int64')
+    for row_ix in range(sorted_m.shape[0]):
+        valid_row_a = sorted_m[row_ix, :num_valid_a[row_ix]]
+        count_m[row_ix] = num_valid_a[row_ix] - np.searchsorted(valid_row_a, cut_off_a, side='left')
+    count_df = pd.DataFrame(count_m, columns=list(cut_offs))
     count_df.index = corr_df.index
     return count_df
 
@@ -1018,6 +1110,38 @@ plot_two_ts(data_a=cor_dist_df, data_b=spy_close_df, title=f"Number of pairs wit
             x_label='Window Start Date', y_label=f'Number of pairs in the {half_year} day window')
 
 
+# -
+
+# <p>
+# The table below shows the number of pairs in each time period for a range of correlation cutoffs.
+# </p>
+
+# +
+
+cutoff_dist_df = calc_corr_dist_cutoffs(corr_df, [0.5, 0.6, 0.7, 0.75, 0.8, 0.9])
+print(tabulate(cutoff_dist_df, headers=[*cutoff_dist_df.columns], tablefmt='fancy_grid'))
+
+# -
+
+# <p>
+# The sector pairs are a small fraction of all of the S&P 500 pairs. The windowed correlation for all of the pairs
+# (including the cross-sector pairs) is calculated in tiles of stocks and stored on disk, so the size of the universe
+# is not limited by memory. The correlation for a window or for a set of pairs is read from the memory mapped file as it
+# is needed. For the sector pairs, this is the same as the correlation calculated above.
+# </p>
+
+# +
+
+# The store is kept with the panel cache entry, so it is rebuilt (and the old store is removed) when the close
+# prices change. It is built from the close price matrix in the panel cache entry.
+all_pairs_corr_store = TiledCorrelationStore(panel_cache.cache_path,
+                                             panel_cache.entry_store_name(f'pair_correlation_{half_year}'))
+if not all_pairs_corr_store.has_files():
+    all_pairs_corr_store.build(panel_cache.close_matrix(), half_year)
+all_pairs_corr_store.open()
+sector_corr_df = all_pairs_corr_store.pairs_frame(pairs_list)
+print(f'all pairs: {all_pairs_corr_store.corr_m.shape[1]} sector pairs: {sector_corr_df.shape[1]}')
+
 # -
 
 # <p>
@@ -1029,10 +1153,15 @@ plot_two_ts(data_a=cor_dist_df, data_b=spy_close_df, title=f"Number of pairs wit
 
 # +
 class CalcPairsCointegration:
-    def __init__(self, close_prices_df: pd.DataFrame):
-        self.close_prices_df = close_prices_df
+    def __init__(self, close_matrix: ClosePriceMatrix, shard: str = None):
+        """
+        :param close_matrix: the memory mapped close prices. The pair windows are views of this matrix.
+        :param shard: if not None, the results are for a shard of the pairs (e.g., a sector) and are stored
+                      with the shard files
+        """
+        self.close_matrix = close_matrix
         self.pair_stat = PairStatistics()
-        self.coint_matrix_io = CointMatrixIO()
+        self.coint_matrix_io = CointMatrixIO(shard=shard)
 
     def compute_halflife(self, z_df: pd.DataFrame) -> int:
         """
@@ -1051,12 +1180,17 @@ class CalcPairsCointegration:
         halflife = round(halflife_f, 0)
         return int(halflife)
 
-    def calc_pair_coint(self, pair_str: str, window_start: int, window: int) -> CointAnalysisResult:
-        pair_l = pair_str.split(':')
-        asset_a = pd.DataFrame(
-            self.close_prices_df[pair_l[0]].iloc[window_start:window_start + window])
-        asset_b = pd.DataFrame(
-            self.close_prices_df[pair_l[1]].iloc[window_start:window_start + window])
+    def no_coint_result(self, pair_str: str) -> CointAnalysisResult:
+        """
+        :return: a result with no cointegration, for a window where one of the stocks does not have prices
+        """
+        no_coint_info = CointInfo(pair_str=pair_str, confidence=0, weight=np.NAN, has_intercept=False, intercept=np.NAN)
+        return CointAnalysisResult(granger_coint=no_coint_info, johansen_coint=no_coint_info)
+
+    def calc_pair_coint(self, sym_a: str, sym_b: str, window_start: int, window: int) -> CointAnalysisResult:
+        pair_str = f'{sym_a}:{sym_b}'
+        asset_a = self.close_matrix.column_df(sym_a, window_start, window_start + window)
+        asset_b = self.close_matrix.column_df(sym_b, window_start, window_start + window)
         granger_coint = self.pair_stat.engle_granger_coint(asset_a, asset_b)
         asset_a_str = asset_a.columns[0]
         asset_b_str = asset_b.columns[0]
@@ -1092,12 +1226,24 @@ class CalcPairsCointegration:
         else:
             coint_info_a = np.zeros(corr_df.shape, dtype='O')
             pairs_l = list(corr_df.columns)
+            # The column names (which may have been read from a file) are parsed once into a pair universe
+            pair_universe = PairUniverse.from_pair_strs(pairs_l)
+            validity = self.close_matrix.validity_mask()
+            col_a, col_b = pair_universe.column_index(validity.symbols)
             window_start = 0
             for row_ix in range(corr_df.shape[0]):
                 print(f'CalcPairsCointegration::calc_pairs_coint_dataframe: processing row {row_ix}')
+                # the pairs where both stocks have prices for the whole window
+                eligible_a = validity.eligible(window_start, window_start + window)
+                pair_eligible_a = eligible_a[col_a] & eligible_a[col_b]
                 for col_ix in range(corr_df.shape[1]):
                     pair_str = pairs_l[col_ix]
-                    coint_info = self.calc_pair_coint(pair_str=pair_str, window_start=window_start, window=window)
+                    sym_a, sym_b, _ = pair_universe[col_ix]
+                    if pair_eligible_a[col_ix]:
+                        coint_info = self.calc_pair_coint(sym_a=sym_a, sym_b=sym_b, window_start=window_start,
+                                                          window=window)
+                    else:
+                        coint_info = self.no_coint_result(pair_str)
                     correlation = corr_df.iloc[row_ix, col_ix]
                     coint_info_a[row_ix, col_ix] = (correlation, coint_info)
                 window_start = window_start + window
@@ -1178,6 +1324,23 @@ class Statistics:
         # Number of pairs with correlation >= cutoff, in-sample johansen = 99 and serial cointegrated
         self.johansen_serial_coint_99: int = 0
 
+    def merge(self, other) -> None:
+        """
+        Add the statistics for another shard of pairs (e.g., another sector). The counts are added, the
+        correlation lists are extended and the pair counts by time period are added. If the shards are merged
+        in column order, the result is the same as the statistics for all of the pairs.
+        """
+        for name, value in other.__dict__.items():
+            if isinstance(value, list):
+                self.__dict__[name].extend(value)
+            elif isinstance(value, pd.DataFrame):
+                if self.__dict__[name].shape[0] == 0:
+                    self.__dict__[name] = value.copy()
+                elif value.shape[0] > 0:
+                    self.__dict__[name] = self.__dict__[name] + value
+            else:
+                self.__dict__[name] += value
+
 
 
 class CalcStatistics:
@@ -1349,13 +1512,56 @@ class CalcStatistics:
 
 
 
-cointegration_calc = CalcPairsCointegration(close_prices_df=close_prices_df)
+# the memory mapped close prices that the panel cache wrote for close_prices_df
+close_matrix = panel_cache.close_matrix()
+cointegration_calc = CalcPairsCointegration(close_matrix=close_matrix)
 coint_info_df = cointegration_calc.calc_pairs_coint_dataframe(corr_df=corr_df, window=half_year)
 
 calc_statistics = CalcStatistics(cutoff=correlation_cutoff, cutoff_2=correlation_cutoff-0.10)
 stats = calc_statistics.traverse(coint_info_df=coint_info_df)
 # -
 
+# <p>
+# No statistic crosses sectors, so the analysis can also be run one sector at a time (a sector shard). The shard results
+# are written to cointegration_data/shards/&lt;sector&gt;, so the shards can be run by separate processes, or on separate
+# machines that share the file system. The merge step combines the shard results, in sector order, into the same
+# correlation/cointegration files as a run over all of the pairs (the files that are read by
+# CalcPairsCointegration.calc_pairs_coint_dataframe). The shard statistics are merged with Statistics.merge.
+# </p>
+
+# +
+
+
+def run_sector_shard(sector: str) -> Statistics:
+    """
+    Calculate the correlation, cointegration and statistics for the pairs in a sector.
+    """
+    shard_pairs = pairs_list.sector_shard(sector)
+    shard_corr_df = SerialCorrelation(close_prices_df, shard_pairs, half_year).serial_correlation()
+    shard_cointegration_calc = CalcPairsCointegration(close_matrix=close_matrix, shard=sector)
+    shard_coint_info_df = shard_cointegration_calc.calc_pairs_coint_dataframe(corr_df=shard_corr_df, window=half_year)
+    return calc_statistics.traverse(coint_info_df=shard_coint_info_df)
+
+
+def merge_sector_shards(sector_l: List[str], shard_stats_l: List[Statistics]) -> Tuple[pd.DataFrame, Statistics]:
+    """
+    :param sector_l: the sectors, in get_pairs order
+    :param shard_stats_l: the statistics for each sector shard
+    :return: the merged correlation/cointegration DataFrame and the merged statistics
+    """
+    merged_coint_info_df = CointMatrixIO().merge_shards(sector_l)
+    merged_stats = Statistics()
+    for shard_stats in shard_stats_l:
+        merged_stats.merge(shard_stats)
+    return merged_coint_info_df, merged_stats
+
+
+# For example:
+# shard_stats_l = [run_sector_shard(sector) for sector in sectors.keys()]
+# coint_info_df, stats = merge_sector_shards(list(sectors.keys()), shard_stats_l)
+
+# -
+
 # <h2>
 # Correlation Statistics
 # </h2>
@@ -31,16 +31,18 @@ from statsmodels.regression.linear_model import RegressionResults
 from statsmodels.tsa.stattools import adfuller
 from tabulate import tabulate
 
-from pairs.pairs import get_pairs
+from pairs.pairs import get_pairs, PairUniverse
 #
 # Local libraries
 #
+from correlation.candidate_search import CandidateSearch
 from plot_ts.plot_time_series import plot_two_ts
-from read_market_data.MarketData import MarketData, read_s_and_p_stock_info, extract_sectors
+from read_market_data.MarketData import MarketData
+from read_market_data.panel_cache import PanelCache
+from read_market_data.price_matrix import ClosePriceMatrix
 from s_and_p_filter import s_and_p_directory, s_and_p_stock_file
-from utils import find_date_index
-from utils.convert_date import convert_date
-from utils.find_date_index import findDateIndex
+from utils.convert_date import convert_dates
+from utils.trading_calendar import TradingCalendar
 
 # <h2>
 # Backtesting a Pairs Trading Strategy
@@ -318,14 +320,17 @@ trading_days = 252
 half_year = int(trading_days / 2)
 quarter = int(trading_days / 4)
 
-stock_info_df = read_s_and_p_stock_info(s_and_p_file)
-stock_l: list = list(set(stock_info_df['Symbol']))
+# By default, stocks that do not have prices for the whole period are dropped. With
+# missing_policy=MissingHistoryPolicy.KEEP the histories are ragged and each backtest period only selects
+# pairs from the stocks that have prices for that period (see ClosePriceMatrix.validity_mask).
 market_data = MarketData(start_date=start_date)
+panel_cache = PanelCache(market_data)
 
-# Get close prices for the S&P 500 list and SPY
-stock_l.append('SPY')
-stock_l.sort()
-close_prices_df = market_data.get_close_data(stock_l)
+# Get close prices for the S&P 500 list and SPY. Some stocks were listed on the stock exchange later than
+# start_date. In this case the stock will not be returned by MarketData.get_close_data(). final_stock_info_df
+# has the Symbol, Name, Sector for the set of stocks that it was possible to obtain close prices for the
+# date range. The panel is loaded from the panel cache if the source data has not changed.
+close_prices_df, final_stock_info_df, sectors = panel_cache.get_panel(s_and_p_file, extra_symbols=['SPY'])
 
 # Get the SPY close data
 spy_close_df = pd.DataFrame(close_prices_df['SPY'])
@@ -337,14 +342,6 @@ final_stock_list = list(close_prices_df.columns)
 # Make sure that SPY is not on the pairs set
 assert not 'SPY' in set(final_stock_list)
 
-mask = stock_info_df['Symbol'].isin(final_stock_list)
-# Some stocks were listed on the stock exchange later than start_date. In this case the stock will not
-# be returned by MarketData.get_close_data(). final_stock_info has the Symbol, Name, Sector for the
-# set of stocks that it was possible to obtain close prices for the date range.
-final_stock_info_df = stock_info_df[mask]
-
-sectors = extract_sectors(final_stock_info_df)
-
 pairs_list = get_pairs(sectors)
 
 
@@ -401,9 +398,19 @@ class InSamplePairBase:
 
     @classmethod
     @abstractmethod
-    def get_in_sample_pairs(self, pairs_list: List[Tuple], close_prices: pd.DataFrame) -> List[CointData]:
+    def get_in_sample_pairs(self, pairs_list: PairUniverse, close_prices: pd.DataFrame, eligible: Set[str] = None) -> List[CointData]:
+        """
+        :param eligible: if the histories are ragged, the symbols that have prices for the whole in-sample period
+                         (eligibility is judged on the in-sample window only, the out-of-sample prices are not
+                         used). Pairs with other symbols are not selected.
+        """
         pass
 
+    def eligible_pairs(self, pairs_list: PairUniverse, eligible: Set[str]) -> PairUniverse:
+        if eligible is not None:
+            pairs_list = pairs_list.eligible_pairs(eligible)
+        return pairs_list
+
 class RandomInSamplePairs(InSamplePairBase):
     def __init__(self, corr_cutoff: float, num_pairs: int) -> None:
         super().__init__(corr_cutoff, num_pairs)
@@ -416,8 +423,9 @@ class RandomInSamplePairs(InSamplePairBase):
                 index_set.add(rand_ix)
         return list(index_set)
 
-    def get_in_sample_pairs(self, pairs_list: List[Tuple], close_prices: pd.DataFrame) -> List[CointData]:
+    def get_in_sample_pairs(self, pairs_list: PairUniverse, close_prices: pd.DataFrame, eligible: Set[str] = None) -> List[CointData]:
         pair_stats_obj = PairStatisticsBase()
+        pairs_list = self.eligible_pairs(pairs_list, eligible)
         random_index: List[int] = self.unique_random_index(self.num_pairs, len(pairs_list) - 1)
         # random_pair_list = pairs_list[ random_index ]
         random_pair_list: List[Tuple] = list(map(lambda ix: pairs_list[ix], random_index))
@@ -504,11 +512,19 @@ class PairStatistics(PairStatisticsBase):
 
 class InSamplePairs(InSamplePairBase):
 
-    def __init__(self, corr_cutoff: float, num_pairs: int) -> None:
+    def __init__(self, corr_cutoff: float, num_pairs: int, candidate_search: CandidateSearch = None,
+                 sector_info: dict = None) -> None:
+        """
+        :param candidate_search: if not None, the top-k correlated cross-sector candidates for the in-sample period
+                                 are added to the sector pairs before the pairs are selected
+        :param sector_info: the sector dictionary, used to label the candidate pairs
+        """
         super().__init__(corr_cutoff=corr_cutoff, num_pairs=num_pairs)
         self.pair_stats_obj = PairStatistics()
+        self.candidate_search = candidate_search
+        self.sector_info = sector_info
 
-    def select_pairs(self, pairs_list: List[Tuple], in_sample_close: pd.DataFrame) -> List[CointData]:
+    def select_pairs(self, pairs_list: PairUniverse, in_sample_close: pd.DataFrame) -> List[CointData]:
         """
         Select pairs with high correlation and cointegratoin
         :param pairs_list: a list of pairs
@@ -525,7 +541,14 @@ class InSamplePairs(InSamplePairBase):
         return coint_list
 
 
-    def get_in_sample_pairs(self, pairs_list: List[Tuple], close_prices: pd.DataFrame) -> List[CointData]:
+    def get_in_sample_pairs(self, pairs_list: PairUniverse, close_prices: pd.DataFrame, eligible: Set[str] = None) -> List[CointData]:
+        pairs_list = self.eligible_pairs(pairs_list, eligible)
+        if self.candidate_search is not None:
+            search_close = close_prices
+            if eligible is not None:
+                search_close = close_prices[[sym for sym in close_prices.columns if sym in eligible]]
+            candidate_pairs, _ = self.candidate_search.search(search_close, sector_info=self.sector_info)
+            pairs_list = pairs_list.merge(candidate_pairs)
         coint_data_list: List[CointData] = self.select_pairs(pairs_list, in_sample_close=close_prices)
         self.pair_stats_obj.add_spread_stats(coint_data_list, close_prices=close_prices)
         # Sort by declining standard deviation value
@@ -567,13 +590,19 @@ def plot_pair_data(close_df: pd.DataFrame, pair: CointData, title_prefix: str) -
 corr_cutoff = 0.75
 num_pairs = 100
 
-in_sample_start = find_date_index.findDateIndex(close_prices_df.index, start_date)
+in_sample_start = TradingCalendar(close_prices_df.index).index_of(start_date)
 in_sample_end = in_sample_start + half_year
 in_sample_df = close_prices_df.iloc[in_sample_start:in_sample_end]
 pairs_stats_obj = PairStatistics()
 period_backtest = InSamplePairs(corr_cutoff=corr_cutoff, num_pairs=num_pairs)
 coint_list = period_backtest.get_in_sample_pairs(pairs_list, close_prices=in_sample_df)
 
+# Cross-sector candidates: the 5 stocks with the most correlated returns for each stock, across all sectors
+candidate_search = CandidateSearch(k=5)
+candidate_pairs, candidate_corr = candidate_search.search(in_sample_df, sector_info=sectors)
+num_cross_sector = int(np.sum(candidate_pairs.sector_code == candidate_pairs.sectors.index(CandidateSearch.cross_sector)))
+print(f'candidate pairs: {len(candidate_pairs)} cross-sector: {num_cross_sector}')
+
 spead_stddev = np.array(list(elem.stddev for elem in coint_list))
 plt.hist(spead_stddev, bins='auto')
 plt.title('Standard Deviation of the Pairs Spread')
@@ -812,7 +841,7 @@ class OutOfSampleBacktest:
         :return:
         """
         date_index = close_prices_df.index
-        start_ix = find_date_index.findDateIndex(date_index, start_date)
+        start_ix = TradingCalendar(date_index).index_of(start_date)
         assert start_ix > 0
         assert (start_ix - window) >= 0
 
@@ -837,7 +866,7 @@ class HistoricalBacktest:
     #             in_sample_pairs_obj = InSamplePairs(corr_cutoff=self.corr_cutoff, num_pairs=self.num_pairs)
 
     def __init__(self,
-                 pairs_list: List[Tuple],
+                 pairs_list: PairUniverse,
                  initial_holdings: int,
                  num_pairs: int,
                  in_sample_days: int,
@@ -848,7 +877,7 @@ class HistoricalBacktest:
                  in_sample_pairs_obj: InSamplePairBase ) -> None:
         """
         Back test pairs trading through a historical period
-        :param pairs_list: the list of possible pairs from the S&P 500. Each Tuple consists of the pair stock
+        :param pairs_list: the universe of possible pairs from the S&P 500. Each pair is a Tuple of the pair stock
                            symbols and the industry sector. For example: ('AAPL', 'ACN', 'information-technology')
         :param initial_holdings: The trading capital. Because this is a long-short strategy, this is the amount of cash
                          that can be used for the required margin.
@@ -1048,15 +1077,18 @@ class HistoricalBacktest:
                              day_close_df: pd.DataFrame,
                              holdings: int,
                              open_positions: Dict[str, Position],
+                             pair_map: Dict[str, CointData],
                              current_date: datetime,
                              day_index: int) -> Tuple[int, DayTransactions]:
+        """
+        :param pair_map: the pairs for the out-of-sample period, by pair key. The open positions are keyed by
+                         the pair key.
+        """
         close_transactions: List[PairTransaction] = list()
         for key, position in open_positions.items():
-            sym_l = key.split(':')
-            stock_a_sym = sym_l[0]
-            stock_b_sym = sym_l[1]
-            close_a = day_close_df[stock_a_sym]
-            close_b = day_close_df[stock_b_sym]
+            pair = pair_map[key]
+            close_a = day_close_df[pair.stock_a]
+            close_b = day_close_df[pair.stock_b]
             transaction = self.close_position(position=position,
                                               close_date=current_date,
                                               day_index=day_index,
@@ -1143,6 +1175,8 @@ class HistoricalBacktest:
         row_date = None
         row_ix = 0
         out_of_sample_day = pd.DataFrame()
+        # the last valid price for each stock on each day (a stock may stop trading in the out-of-sample period)
+        last_valid_df = out_of_sample_df.ffill()
         day_transactions_l: List[DayTransactions] = list()
         for row_ix in range(start_ix, end_ix):
             pair_budget = self.calc_pair_budget(holdings)
@@ -1155,6 +1189,19 @@ class HistoricalBacktest:
                 back_win_stock_b = pd.DataFrame(out_of_sample_back[pair.stock_b])
                 stock_a_day = out_of_sample_day[pair.stock_a]
                 stock_b_day = out_of_sample_day[pair.stock_b]
+                if np.isnan(stock_a_day) or np.isnan(stock_b_day) or \
+                        back_win_stock_a.isna().values.any() or back_win_stock_b.isna().values.any():
+                    # A stock has a missing price. A position is not opened and an open position is closed at
+                    # the last valid prices.
+                    if pair.key in open_positions:
+                        transaction = self.close_position(position=open_positions[pair.key],
+                                                          close_date=row_date,
+                                                          day_index=row_ix,
+                                                          price_a=last_valid_df[pair.stock_a].iloc[row_ix],
+                                                          price_b=last_valid_df[pair.stock_b].iloc[row_ix])
+                        daily_transactions.append(transaction)
+                        del open_positions[pair.key]
+                    continue
                 day_stats: DailyStats = self.spread_stats(pair=pair,
                                                           back_win_stock_a=back_win_stock_a,
                                                           back_win_stock_b=back_win_stock_b,
@@ -1180,9 +1227,10 @@ class HistoricalBacktest:
                 day_transactions_l.append(day_transactions)
         if len(open_positions) > 0:
             # At the end of the trading period (e.g., the quarter) all open positions must be closed at the last price
-            holdings, day_transactions = self.close_open_positions(day_close_df=out_of_sample_day,
+            holdings, day_transactions = self.close_open_positions(day_close_df=last_valid_df.iloc[row_ix],
                                                                    holdings=holdings,
                                                                    open_positions=open_positions,
+                                                                   pair_map={pair.key: pair for pair in pairs_list},
                                                                    current_date=row_date,
                                                                    day_index=row_ix)
             if day_transactions is not None:
@@ -1217,13 +1265,18 @@ class HistoricalBacktest:
             count_map[pair_count] = count
 
     def historical_backtest(self,
-                            close_prices_df: pd.DataFrame,
+                            close_matrix: ClosePriceMatrix,
                             start_date: datetime,
                             delta: float) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
-        date_index = close_prices_df.index
-        start_ix = find_date_index.findDateIndex(date_index, start_date)
+        """
+        :param close_matrix: the memory mapped close prices. The in-sample and out-of-sample windows are
+                             views of this matrix, not copies.
+        """
+        date_index = close_matrix.index
+        validity = close_matrix.validity_mask()
+        start_ix = close_matrix.calendar.index_of(start_date)
         assert start_ix >= 0
-        end_ix = close_prices_df.shape[0]  # number of rows in close_prices_df
+        end_ix = close_matrix.shape()[0]  # number of rows in the close price matrix
         print(f'index range: {start_ix} - end_ix: {end_ix}')
         all_transactions_df = pd.DataFrame()
         holdings_l: List[float] = list()
@@ -1240,10 +1293,17 @@ class HistoricalBacktest:
             print(f'in-sample: {ix}:{in_sample_end_ix} {in_sample_date_start}:{in_sample_date_end}')
             print(
                 f'out-of-sample: {in_sample_end_ix}:{out_of_sample_end} dates:{date_index[in_sample_end_ix]}:{date_index[out_of_sample_end]}')
-            in_sample_close_df = pd.DataFrame(close_prices_df.iloc[ix:in_sample_end_ix])
-            selected_pairs: List[CointData] = self.in_sample_pairs_obj.get_in_sample_pairs(pairs_list=self.pairs_list, close_prices=in_sample_close_df)
+            in_sample_close_df = close_matrix.window_df(ix, in_sample_end_ix)
+            # With ragged histories, only the stocks that have prices for the whole in-sample period are eligible.
+            # The out-of-sample prices are not used to select the pairs (that would be look-ahead bias). A stock
+            # that stops trading in the out-of-sample period is handled in out_of_sample_test.
+            # The close price matrix may have columns that are not in the pairs universe (e.g., SPY).
+            eligible = set(validity.eligible_symbols(ix, in_sample_end_ix)) & set(self.pairs_list.symbols)
+            selected_pairs: List[CointData] = self.in_sample_pairs_obj.get_in_sample_pairs(pairs_list=self.pairs_list,
+                                                                                           close_prices=in_sample_close_df,
+                                                                                           eligible=eligible)
             self.pairs_stock_distribution(coint_pairs=selected_pairs, count_map=count_map)
-            out_of_sample_df = pd.DataFrame(close_prices_df.iloc[out_of_sample_start:out_of_sample_end])
+            out_of_sample_df = close_matrix.window_df(out_of_sample_start, out_of_sample_end)
             holdings, day_transactions_df = self.out_of_sample_test(start_ix=self.back_window,
                                                                     out_of_sample_df=out_of_sample_df,
                                                                     pairs_list=selected_pairs,
@@ -1313,6 +1373,8 @@ day_limit = 10
 if not os.path.exists(pairs_result_dir):
     os.mkdir(pairs_result_dir)
 if not os.path.exists(pairs_result_path):
+    # the memory mapped close prices that the panel cache wrote (this includes the SPY column)
+    close_matrix = panel_cache.close_matrix()
     in_sample_pair_obj = InSamplePairs(corr_cutoff=corr_cutoff, num_pairs=num_pairs)
     historical_backtest = HistoricalBacktest(pairs_list=pairs_list,
                                              initial_holdings=initial_holdings,
@@ -1323,7 +1385,7 @@ if not os.path.exists(pairs_result_path):
                                              delta=delta,
                                              day_limit=day_limit,
                                              in_sample_pairs_obj=in_sample_pair_obj)
-    all_transactions_df, holdings_df, pairs_count_df = historical_backtest.historical_backtest(close_prices_df=close_prices_df,
+    all_transactions_df, holdings_df, pairs_count_df = historical_backtest.historical_backtest(close_matrix=close_matrix,
                                                                                start_date=start_date,
                                                                                delta=delta)
     all_transactions_df.to_csv(pairs_result_path)
@@ -1340,7 +1402,7 @@ if not os.path.exists(pairs_result_path):
                                              delta=delta,
                                              day_limit=day_limit,
                                              in_sample_pairs_obj=in_sample_random_pair_obj)
-    all_rand_transactions_df, rand_holdings_df, rand_pairs_count_df = random_historical_backtest.historical_backtest(close_prices_df=close_prices_df,
+    all_rand_transactions_df, rand_holdings_df, rand_pairs_count_df = random_historical_backtest.historical_backtest(close_matrix=close_matrix,
                                                                                start_date=start_date,
                                                                                delta=delta)
     all_rand_transactions_df.to_csv(rand_pairs_result_path)
@@ -1538,8 +1600,8 @@ def spy_portfolio_period(spy_close_df: pd.DataFrame, start_date: datetime, end_d
     :return: a DataFrame containing the SPY time series relative to the initial investment.
     """
     spy_date_index = spy_close_df.index
-    spy_start_ix = findDateIndex(spy_date_index, start_date)
-    spy_end_ix = findDateIndex(spy_date_index, end_date)
+    spy_calendar = TradingCalendar(spy_date_index)
+    spy_start_ix, spy_end_ix = spy_calendar.index_of([start_date, end_date])
     spy_close_period_df = spy_close_df.iloc[spy_start_ix:spy_end_ix + 1]
     return_calculation = ReturnCalculation()
     spy_return_df = return_calculation.calc_return_df(spy_close_period_df)
@@ -1547,8 +1609,7 @@ def spy_portfolio_period(spy_close_df: pd.DataFrame, start_date: datetime, end_d
     spy_return_index = spy_return_df.index
     spy_return_start_date = pd.to_datetime(spy_return_index[0])
     spy_return_end_date = pd.to_datetime(spy_return_index[-1])
-    spy_start_ix = findDateIndex(spy_date_index, spy_return_start_date)
-    spy_end_ix = findDateIndex(spy_date_index, spy_return_end_date)
+    spy_start_ix, spy_end_ix = spy_calendar.index_of([spy_return_start_date, spy_return_end_date])
     spy_portfolio_df.index = pd.to_datetime(spy_date_index[spy_start_ix - 1:spy_end_ix + 1])
     spy_portfolio_df.columns = ['SPY']
     return spy_portfolio_df
@@ -1599,27 +1660,20 @@ plot_dataframes(df_list=[spy_portfolio_df, profit_portfolio_df, random_portfolio
                     title='Pairs, Random Pairs and SPY Portfolio')
 
 def yearly_return(portfolio_df: pd.DataFrame) -> pd.DataFrame:
-    first_row = True
-    year_list = list()
-    return_list = list()
-    year_last_value = 0
-    year_start_value = 0
-    current_year = None
-    for row_date, row_val in portfolio_df.iterrows():
-        row_date = convert_date(row_date)
-        row_val = row_val.values[0]
-        if first_row:
-            current_year = row_date.year
-            year_start_value = row_val
-            first_row = False
-        elif row_date.year == current_year:
-            year_last_value = row_val
-        elif row_date.year != current_year:
-            year_list.append(current_year)
-            year_return = round(((year_last_value / year_start_value) - 1) * 100, 2)
-            return_list.append(year_return)
-            current_year = row_date.year
-            year_start_value = row_val
+    """
+    :param portfolio_df: a single column portfolio value DataFrame with a date index
+    :return: the percent return for each year, from the first to the last value in the year. The last
+             (partial) year is not included.
+    """
+    values_a = portfolio_df.values[:, 0]
+    years_a = convert_dates(portfolio_df.index).astype('datetime64[Y]').astype(int) + 1970
+    # the row indexes where a new year starts
+    year_start_a = np.concatenate([[0], np.flatnonzero(np.diff(years_a)) + 1]).astype(int)
+    year_end_a = np.append(year_start_a[1:], len(years_a)) - 1
+    year_start_a = year_start_a[:-1]
+    year_end_a = year_end_a[:-1]
+    return_list = list(np.round(((values_a[year_end_a] / values_a[year_start_a]) - 1) * 100, 2))
+    year_list = list(years_a[year_start_a])
     year_return_df = pd.DataFrame(return_list)
     year_return_df.index = year_list
     year_return_df.columns = portfolio_df.columns
@@ -1664,8 +1718,7 @@ print(f'total percent positive trades: {round((sum(positive_trades)/sum(total_tr
 
 def return_slice(return_df: pd.DataFrame, start_date: datetime, end_date: datetime) -> pd.DataFrame:
     return_index = return_df.index
-    start_ix = findDateIndex(return_index, start_date)
-    end_ix = findDateIndex(return_index, end_date)
+    start_ix, end_ix = TradingCalendar(return_index).index_of([start_date, end_date])
     assert start_ix >= 0 and end_ix >= 0
     slice = return_df.iloc[start_ix:end_ix]
     return slice
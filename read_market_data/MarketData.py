@@ -1,45 +1,87 @@
 
 import os
 import pandas as pd
-import yfinance as yf
 
 from datetime import datetime, timedelta
+from typing import List, Dict, Tuple
 from utils.convert_date import convert_date
-from multiprocessing import Pool, cpu_count
+from utils.trading_calendar import TradingCalendar
+from read_market_data.derived_bars import BarTimeframe, DerivedBarCache
+from read_market_data.fetch_engine import FetchEngine
+from read_market_data.panel_alignment import MissingHistoryPolicy, apply_missing_policy, coverage_report
+from read_market_data.market_data_provider import MarketDataProvider, YahooProvider, split_market_data
+from read_market_data.negative_cache import NegativeCache
+from read_market_data.price_panel import PricePanelStore
 
 
 class MarketData:
     """
-    This class supports retrieving and storing stock market close data from Yahoo.
+    This class supports retrieving and storing daily stock market data (open, high, low, close and volume)
+    from Yahoo.
     """
 
-    def __init__(self, start_date: datetime):
+    def __init__(self,
+                 start_date: datetime,
+                 path: str = 's_and_p_data',
+                 provider: MarketDataProvider = None,
+                 batch_size: int = 100,
+                 fetch_engine: FetchEngine = None,
+                 missing_policy: MissingHistoryPolicy = MissingHistoryPolicy.DROP,
+                 min_coverage: float = 0.95,
+                 no_data_ttl_days: int = 7):
+        """
+        :param start_date: the start date for the market data
+        :param path: the directory for the per-symbol CSV files
+        :param provider: the source of the market data. By default this is Yahoo Finance.
+        :param batch_size: the number of symbols requested in each provider call when the close data is
+                           refreshed. A batch size of 1 fetches each symbol separately.
+        :param fetch_engine: the thread pool, with rate limiting and retry, that runs the refresh requests. The
+                             provider uses the fetch engine's session (see MarketDataProvider.use_session).
+        :param missing_policy: how get_close_data handles stocks that are missing part of the history
+        :param min_coverage: the minimum fraction of dates with data for MissingHistoryPolicy.MIN_COVERAGE
+        :param no_data_ttl_days: the number of days that a symbol for which the provider returned no data is
+                                 skipped before it is requested again
+        """
         self.start_date = convert_date(start_date)
         # self.end_date: datetime = convert_date(datetime.today() - timedelta(days=1))
         self.end_date: datetime = convert_date(datetime.today())
-        self.path = 's_and_p_data'
+        self.path = path
+        self.batch_size = batch_size
+        self.fetch_engine = fetch_engine if fetch_engine is not None else FetchEngine()
+        # the provider's HTTP requests use the fetch engine's connection pool
+        self.provider = provider if provider is not None else YahooProvider()
+        self.provider.use_session(self.fetch_engine.session)
+        self.missing_policy = missing_policy
+        self.min_coverage = min_coverage
+        # The per-symbol coverage of the last panel returned by get_close_data
+        self.coverage_df = pd.DataFrame()
+        # The number of bytes read from the end of a CSV file to find its last date
+        self.tail_bytes = 1024
+        # The symbols for which the provider returned no data
+        self.negative_cache = NegativeCache(path, ttl_days=no_data_ttl_days)
 
     def get_market_data(self,
                         symbol: str,
                         start_date: datetime,
                         end_date: datetime) -> pd.DataFrame:
-        data_col = 'Close'
-        if type(symbol) == str:
-            t = list()
-            t.append(symbol)
-        panel_data = yf.download(tickers=symbol, start=start_date, end=end_date, progress=False)
-        if panel_data.shape[0] > 0:
-            close_data: pd.DataFrame = panel_data[data_col]
-        else:
-            close_data = pd.DataFrame()
-        if close_data.shape[0] > 0:
-            close_data = close_data.round(2)
-            close_data_df = pd.DataFrame(close_data)
-            index = pd.to_datetime(close_data_df.index.strftime('%Y-%m-%d'))
-            close_data_df.index = index
-        else:
-            close_data_df = pd.DataFrame()
-        return close_data_df
+        """
+        :return: a DataFrame with the daily bars for the symbol (one column per OHLCV field)
+        """
+        symbol_dict, _ = self.get_batch_market_data([symbol], start_date, end_date)
+        return symbol_dict[symbol]
+
+    def get_batch_market_data(self,
+                              symbols: List[str],
+                              start_date: datetime,
+                              end_date: datetime) -> Tuple[Dict[str, pd.DataFrame], List[str]]:
+        """
+        Fetch the daily bars for a list of symbols with one provider request.
+
+        :return: a dictionary of symbol -> OHLCV DataFrame (empty if the symbol has no data) and the symbols
+                 that the provider reported as having no data
+        """
+        panel_data, no_data_l = self.provider.download_with_status(symbols, start_date, end_date)
+        return split_market_data(panel_data, symbols), no_data_l
 
     def symbol_file_path(self, symbol: str) -> str:
         path: str = self.path + os.path.sep + symbol.upper() + '.csv'
@@ -51,72 +93,297 @@ class MarketData:
         return last_date
 
     def findDateIndexFromEnd(self, data_df: pd.DataFrame, search_date: datetime) -> int:
-        found_index = -1
-        search_date = convert_date(search_date)
-        index = data_df.index
-        for i in range(len(index)-1, -1, -1):
-            ix_date = convert_date(index[i])
-            if ix_date == search_date:
-                found_index = i
-                break
-        return found_index
+        """
+        :return: the index of search_date in the DataFrame index or -1 if the date is not in the index
+        """
+        return TradingCalendar(data_df.index).exact_index_of(search_date)
+
+
+    def file_last_date(self, file_path: str) -> datetime:
+        """
+        Find the last date in a symbol CSV file by reading only the tail of the file.
+
+        :return: the date of the last row or None if the file does not exist or has no data rows
+        """
+        last_date = None
+        if os.access(file_path, os.R_OK):
+            with open(file_path, 'rb') as csv_file:
+                csv_file.seek(0, os.SEEK_END)
+                file_size = csv_file.tell()
+                csv_file.seek(max(file_size - self.tail_bytes, 0))
+                tail = csv_file.read().decode()
+            lines = [line for line in tail.splitlines() if len(line.strip()) > 0]
+            if len(lines) > 0:
+                date_str = lines[-1].split(',')[0]
+                if date_str != 'Date':
+                    last_date = convert_date(date_str)
+        return last_date
+
+    def append_data(self, file_path: str, new_data_df: pd.DataFrame) -> None:
+        """
+        Append new rows to the end of a symbol CSV file, without rewriting the existing rows. The new rows
+        are written with the columns in the file header, so a file that was created with only the close
+        prices stays a close price file.
+        """
+        with open(file_path, 'rb') as csv_file:
+            header = csv_file.readline().decode().strip().split(',')
+            csv_file.seek(0, os.SEEK_END)
+            ends_with_newline = csv_file.tell() == 0
+            if not ends_with_newline:
+                csv_file.seek(-1, os.SEEK_END)
+                ends_with_newline = csv_file.read(1) == b'\n'
+        with open(file_path, 'a') as csv_file:
+            if not ends_with_newline:
+                csv_file.write('\n')
+            new_data_df.reindex(columns=header[1:]).to_csv(csv_file, header=False)
+
+    def store_market_data(self, symbol: str, last_date: datetime, symbol_df: pd.DataFrame) -> int:
+        """
+        Store newly fetched data for a symbol. If the symbol has no CSV file (last_date is None) the file is
+        written, otherwise the rows after last_date are appended to the file.
+
+        :return: the number of rows that were added
+        """
+        num_rows = 0
+        file_path = self.symbol_file_path(symbol)
+        if symbol_df.shape[0] > 0:
+            if last_date is None:
+                if not os.access(self.path, os.R_OK):
+                    os.mkdir(self.path)
+                symbol_df.to_csv(file_path, index_label='Date')
+                num_rows = symbol_df.shape[0]
+            else:
+                new_data_df = symbol_df[symbol_df.index > last_date]
+                if new_data_df.shape[0] > 0:
+                    self.append_data(file_path, new_data_df)
+                    num_rows = new_data_df.shape[0]
+        return num_rows
+
+    def fetch_start_date(self, last_date: datetime) -> datetime:
+        """
+        :return: the start date for fetching new data. A week of overlap is requested for existing data.
+        """
+        return self.start_date if last_date is None else last_date - timedelta(weeks=1)
+
+    def refresh_data(self, symbol: str) -> int:
+        """
+        Bring the CSV file for a symbol up to date. Only the tail of an existing file is read to find the
+        last date. New rows are appended to the file, so the cost of a refresh depends on the number of new
+        rows, not on the length of the history.
+
+        :return: the number of rows that were added
+        """
+        num_rows = 0
+        last_date = self.file_last_date(self.symbol_file_path(symbol))
+        if last_date is None or self.is_stale(last_date):
+            fetch_start = self.fetch_start_date(last_date)
+            if not self.negative_cache.skip(symbol, fetch_start):
+                symbol_dict, no_data_l = self.get_batch_market_data([symbol], fetch_start, self.end_date)
+                self.update_negative_cache(fetch_start, symbol_dict, no_data_l)
+                num_rows = self.store_market_data(symbol, last_date, symbol_dict[symbol])
+                self.negative_cache.write()
+        return num_rows
+
+    def update_negative_cache(self,
+                              fetch_start: datetime,
+                              symbol_dict: Dict[str, pd.DataFrame],
+                              no_data_l: List[str]) -> None:
+        """
+        Update the negative cache from the result of a provider request. A symbol is only recorded when the
+        provider explicitly reported that it has no data (e.g., an HTTP 404 or a yfinance "delisted" error).
+        If none of the symbols in a batch of several symbols returned data, the whole request may have
+        failed (e.g., it was throttled), so no symbol is recorded. A symbol that returned data is removed.
+
+        :param fetch_start: the start date of the request
+        :param symbol_dict: the data returned for each requested symbol (see get_batch_market_data)
+        :param no_data_l: the symbols that the provider reported as having no data
+        """
+        batch_empty = all(symbol_df.shape[0] == 0 for symbol_df in symbol_dict.values())
+        for sym, symbol_df in symbol_dict.items():
+            if symbol_df.shape[0] > 0:
+                self.negative_cache.remove(sym)
+            elif sym in no_data_l and (not batch_empty or len(symbol_dict) == 1):
+                self.negative_cache.record(sym, fetch_start, self.end_date)
 
+    def skipped_symbols(self) -> pd.DataFrame:
+        """
+        :return: the symbols that are not requested because the provider returned no data for them (see
+                 read_market_data.negative_cache.NegativeCache.report)
+        """
+        return self.negative_cache.report()
+
+    def refresh_batch_task(self, task: tuple) -> int:
+        """
+        :param task: a tuple of the fetch start date and a list of (symbol, last date) tuples
+        :return: the number of rows that were added
+        """
+        num_rows = 0
+        fetch_start, batch = task
+        batch_dict, no_data_l = self.get_batch_market_data([sym for sym, _ in batch], fetch_start, self.end_date)
+        self.update_negative_cache(fetch_start, batch_dict, no_data_l)
+        for sym, last_date in batch:
+            num_rows += self.store_market_data(sym, last_date, batch_dict[sym])
+        return num_rows
+
+    def refresh_batch(self, stock_list: List[str]) -> int:
+        """
+        Bring the CSV files for the symbols in stock_list up to date, requesting up to self.batch_size
+        symbols per provider call. Symbols that need data from the same start date are fetched together.
+        The batches are run concurrently by the fetch engine. Symbols in the negative cache are skipped.
+
+        :return: the number of rows that were added
+        """
+        start_groups: Dict[datetime, List[tuple]] = dict()
+        skipped_l: List[str] = list()
+        for sym in stock_list:
+            last_date = self.file_last_date(self.symbol_file_path(sym))
+            if last_date is None or self.is_stale(last_date):
+                fetch_start = self.fetch_start_date(last_date)
+                if self.negative_cache.skip(sym, fetch_start):
+                    skipped_l.append(sym)
+                else:
+                    start_groups.setdefault(fetch_start, list()).append((sym, last_date))
+        if len(skipped_l) > 0:
+            print(f'Skipped {len(skipped_l)} symbols that returned no data: {", ".join(skipped_l)}')
+        tasks: List[tuple] = list()
+        batch_size = max(self.batch_size, 1)
+        for fetch_start, sym_l in start_groups.items():
+            for batch_start in range(0, len(sym_l), batch_size):
+                tasks.append((fetch_start, sym_l[batch_start:batch_start + batch_size]))
+        results = self.fetch_engine.map(self.refresh_batch_task, tasks)
+        self.negative_cache.write()
+        num_rows = sum(rows for rows in results if rows is not None)
+        return num_rows
 
     def read_data(self, symbol: str) -> pd.DataFrame:
-        changed = False
+        """
+        Refresh the CSV file for the symbol and return its close prices.
+
+        :return: a DataFrame with a DatetimeIndex and a single column named by the symbol
+        """
+        self.refresh_data(symbol)
         file_path = self.symbol_file_path(symbol)
-        # Check to see if the file exists
         symbol_df = pd.DataFrame()
         if os.access(file_path, os.R_OK):
-            # The file exists, so read the CSV data
-            symbol_df = pd.read_csv(file_path, index_col='Date')
-        if symbol_df.shape[0] == 0:
-            # Either the file contained no data or it didn't exist
-            symbol_df = self.get_market_data(symbol, self.start_date, self.end_date)
+            symbol_df = pd.read_csv(file_path, index_col='Date', parse_dates=True)
         if symbol_df.shape[0] > 0:
-            last_date = self.df_last_date(symbol_df)
-            if last_date.date() < (self.end_date - timedelta(days=1)).date():
-                sym_start_date = last_date - timedelta(weeks=1)
-                new_data_df = self.get_market_data(symbol, sym_start_date, self.end_date)
-                if new_data_df.shape[0] > 0:
-                    new_last_date = self.df_last_date(new_data_df)
-                    if new_last_date > last_date:
-                        last_date_ix = self.findDateIndexFromEnd(new_data_df, last_date)
-                        if last_date_ix+1 < new_data_df.shape[0]:
-                            new_data_sec = new_data_df.iloc[last_date_ix+1:]
-                            symbol_df = pd.concat([symbol_df, new_data_sec], axis=0)
-                            ix = symbol_df.index
-                            ix = pd.to_datetime(ix)
-                            symbol_df.index = ix
-                            changed = True
-            if not os.access(self.path, os.R_OK):
-                os.mkdir(self.path)
-            if type(symbol_df) != pd.DataFrame:
-                symbol_df = pd.DataFrame(symbol_df)
-            if changed:
-                symbol_df.to_csv(file_path)
+            col = 'Close' if 'Close' in symbol_df.columns else symbol_df.columns[0]
+            symbol_df = pd.DataFrame(symbol_df[col])
             symbol_df.columns = [symbol]
         return symbol_df
 
-    def get_close_data(self, stock_list: list) -> pd.DataFrame:
-        # fetch the close data in parallel
-        n_cores = cpu_count()
-        close_df = pd.DataFrame()
+    def is_stale(self, last_date: datetime) -> bool:
+        return last_date.date() < (self.end_date - timedelta(days=1)).date()
+
+    def refresh_stale_data(self, stock_list: list, end_date: datetime = None) -> None:
+        """
+        Refresh the symbols whose data in the panel store is out of date (or that are not in the store).
+
+        :param end_date: if the data is only needed up to end_date (exclusive), the symbols whose stored
+                         data reaches end_date are not refreshed
+        """
+        panel_store = PricePanelStore(self.path)
+        last_date_dict = panel_store.last_dates(stock_list)
+        stale_list = list()
+        for sym in stock_list:
+            if sym not in last_date_dict:
+                stale_list.append(sym)
+            elif self.is_stale(last_date_dict[sym]):
+                if end_date is None or last_date_dict[sym].date() < (end_date - timedelta(days=1)).date():
+                    stale_list.append(sym)
+        if len(stale_list) > 0:
+            self.refresh_batch(stale_list)
+
+    def current_panel_store(self, stock_list: list, refresh: bool, end_date: datetime = None) -> PricePanelStore:
+        """
+        :return: the panel store, brought up to date for the symbols in stock_list
+        """
         assert len(stock_list) > 0
-        with Pool(processes=(n_cores*2)) as mp_pool:
-            close_list = mp_pool.map(self.read_data, stock_list)
-        # close_list = list()
-        # for sym in stock_list:
-        #     sym_close_df = self.read_data(sym)
-        #     close_list.append(sym_close_df)
-        for close_data in close_list:
-            close_df = pd.concat([close_df, close_data], axis=1)
+        if refresh:
+            self.refresh_stale_data(stock_list, end_date)
+        panel_store = PricePanelStore(self.path)
+        if not panel_store.is_current(stock_list):
+            panel_store.build(stock_list)
+        return panel_store
+
+    def get_field_data(self,
+                       stock_list: list,
+                       fields: List[str],
+                       refresh: bool = True,
+                       start_date: datetime = None,
+                       end_date: datetime = None) -> Dict[str, pd.DataFrame]:
+        """
+        Return the requested OHLCV fields for the stocks in stock_list. Only the panel files for these fields
+        are read. The missing history policy is not applied: the columns can be selected to match the
+        DataFrame returned by get_close_data (e.g., volume_df[close_df.columns]).
+
+        :param stock_list: the symbols for the stocks
+        :param fields: the fields (e.g., ['Close', 'Volume'])
+        :param refresh: if False, the stored data is used without refreshing the stale symbols
+        :param start_date: the first date (inclusive) or None for the whole history
+        :param end_date: the end date (exclusive) or None for the latest data
+        :return: a dictionary of field -> DataFrame (dates x symbols). Stocks whose CSV file only has close
+                 prices have NaN values for the other fields.
+        """
+        panel_store = self.current_panel_store(stock_list, refresh, end_date)
+        return panel_store.load_fields(stock_list, fields, start_date, end_date)
+
+    def get_close_data(self,
+                       stock_list: list,
+                       refresh: bool = True,
+                       start_date: datetime = None,
+                       end_date: datetime = None) -> pd.DataFrame:
+        """
+        Return the close prices for the stocks in stock_list. The prices are loaded from the consolidated
+        panel store, which is rebuilt from the per-symbol CSV files only when one of these files has changed.
+        Only the symbols whose stored data is out of date are refreshed from the market data source.
+
+        Only the rows in the date range and the columns for stock_list are read from the store, so a
+        short window for a few symbols does not load the whole panel.
+
+        The per-symbol coverage of the aligned panel is available in self.coverage_df. The stocks that are
+        returned are selected by self.missing_policy (the coverage is measured over the date range).
+
+        :param stock_list: the symbols for the stocks
+        :param refresh: if False, the stored data is used without refreshing the stale symbols
+        :param start_date: the first date (inclusive) or None for the whole history
+        :param end_date: the end date (exclusive) or None for the latest data
+        """
+        panel_store = self.current_panel_store(stock_list, refresh, end_date)
+        close_df = panel_store.load(stock_list, start_date, end_date)
         # The last row may be fetched from "today" and be NaN values. Remove this row
         last_row = close_df[-1:]
         if all(last_row.isna().all()):
             close_df = close_df[:-1]
-        # drop the stocks with different start dates
-        close_df = close_df.dropna(axis='columns')
+        self.coverage_df = coverage_report(close_df)
+        # by default, drop the stocks with different start dates
+        close_df = apply_missing_policy(close_df, self.missing_policy, self.min_coverage)
+        return close_df
+
+    def get_bar_close_data(self,
+                           stock_list: list,
+                           timeframe: BarTimeframe,
+                           refresh: bool = True,
+                           start_date: datetime = None,
+                           end_date: datetime = None) -> pd.DataFrame:
+        """
+        Return the weekly or monthly close prices for the stocks in stock_list. The bars are read from the
+        derived bar cache, which is updated incrementally from the daily panel, so the daily data is not
+        resampled on each call. The stocks are selected by self.missing_policy, as in get_close_data.
+
+        :param stock_list: the symbols for the stocks
+        :param timeframe: the bar timeframe (BarTimeframe.WEEKLY or BarTimeframe.MONTHLY)
+        :param refresh: if False, the stored data is used without refreshing the stale symbols
+        :param start_date: the first date (inclusive) or None for the whole history
+        :param end_date: the end date (exclusive) or None for the latest data
+        """
+        self.current_panel_store(stock_list, refresh, end_date)
+        bar_cache = DerivedBarCache(self.path, timeframe)
+        if not bar_cache.is_current():
+            bar_cache.build()
+        close_df = bar_cache.load(stock_list, start_date, end_date)
+        self.coverage_df = coverage_report(close_df)
+        close_df = apply_missing_policy(close_df, self.missing_policy, self.min_coverage)
         return close_df
 
 
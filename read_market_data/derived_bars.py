@@ -0,0 +1,136 @@
+
+import os
+from enum import Enum
+from typing import List, Dict
+
+import numpy as np
+import pandas as pd
+
+from read_market_data.market_data_provider import ohlcv_fields
+from read_market_data.price_codec import save_field
+from read_market_data.price_panel import PricePanelStore
+
+
+class BarTimeframe(Enum):
+    # The values are pandas period frequencies
+    WEEKLY = 'W-FRI'
+    MONTHLY = 'M'
+
+
+def resample_bars(field_dict: Dict[str, pd.DataFrame], timeframe: BarTimeframe) -> Dict[str, pd.DataFrame]:
+    """
+    Aggregate daily bars into weekly or monthly bars. The open is the first value in the period, the high the
+    maximum, the low the minimum, the close the last value and the volume the sum. A bar is labeled with the
+    last trading date in its period.
+
+    :param field_dict: a dictionary of field -> DataFrame (dates x symbols) with the daily bars
+    :return: a dictionary of field -> DataFrame (periods x symbols)
+    """
+    first_df = next(iter(field_dict.values()))
+    period_a = first_df.index.to_period(timeframe.value)
+    # the label of each period is its last trading date
+    label_s = pd.Series(first_df.index, index=first_df.index).groupby(period_a).last()
+    bar_dict: Dict[str, pd.DataFrame] = dict()
+    for field, field_df in field_dict.items():
+        grouped = field_df.groupby(period_a)
+        if field == 'Open':
+            bar_df = grouped.first()
+        elif field == 'High':
+            bar_df = grouped.max()
+        elif field == 'Low':
+            bar_df = grouped.min()
+        elif field == 'Volume':
+            bar_df = grouped.sum(min_count=1)
+        else:
+            bar_df = grouped.last()
+        bar_df.index = pd.DatetimeIndex(label_s.values, name='Date')
+        bar_dict[field] = bar_df
+    return bar_dict
+
+
+class DerivedBarCache(PricePanelStore):
+    """
+    A cache of weekly or monthly bars that are derived from the daily price panel.
+
+    The derived bars are stored in the same layout as the daily panel (in the directory
+    panel/derived_<timeframe>), so they are loaded with the same methods (load, load_fields), including the
+    symbol and date range selection. The file source.csv records the number of daily rows and the last daily
+    date that the bars were built from. When new days are appended to the daily panel, only the last
+    (possibly partial) bar and the new bars are recalculated.
+    """
+    source_file_name = 'source.csv'
+
+    def __init__(self, csv_path: str, timeframe: BarTimeframe):
+        """
+        :param csv_path: the directory that contains the per-symbol CSV files (and the daily panel)
+        :param timeframe: the bar timeframe
+        """
+        super().__init__(csv_path)
+        self.timeframe = timeframe
+        self.daily_store = PricePanelStore(csv_path)
+        self.panel_path = self.daily_store.panel_path + os.path.sep + 'derived_' + timeframe.name.lower()
+        self.dates_file_path = self.panel_path + os.path.sep + self.dates_file_name
+        self.symbols_file_path = self.panel_path + os.path.sep + self.symbols_file_name
+        self.source_file_path = self.panel_path + os.path.sep + self.source_file_name
+
+    def read_source(self) -> tuple:
+        """
+        :return: the number of daily rows and the last daily date (a datetime64[D]) the bars were built from
+        """
+        source = (0, None)
+        if self.has_files() and os.access(self.source_file_path, os.R_OK):
+            source_df = pd.read_csv(self.source_file_path)
+            source = (int(source_df['num_rows'].iloc[0]), np.datetime64(source_df['last_date'].iloc[0], 'D'))
+        return source
+
+    def is_current(self, stock_list: List[str] = None) -> bool:
+        """
+        The derived bars are current if they were built from all of the rows and symbols in the daily panel.
+        """
+        current = False
+        num_rows, last_date = self.read_source()
+        if num_rows > 0 and self.daily_store.has_files():
+            daily_dates_a = np.load(self.daily_store.dates_file_path)
+            current = daily_dates_a.shape[0] == num_rows and daily_dates_a[-1] == last_date and \
+                      list(self.read_symbol_table().index) == list(self.daily_store.read_symbol_table().index)
+        return current
+
+    def build(self, stock_list: List[str] = None) -> None:
+        """
+        Update the derived bars from the daily panel (the daily panel must be current). If the daily panel
+        only has new rows since the last build, the bars are recalculated from the start of the last stored
+        period. Otherwise all of the bars are recalculated.
+        """
+        symbols = list(self.daily_store.read_symbol_table().index)
+        daily_dates_a = np.load(self.daily_store.dates_file_path)
+        num_rows, last_date = self.read_source()
+        incremental = 0 < num_rows <= daily_dates_a.shape[0] and daily_dates_a[num_rows - 1] == last_date and \
+                      list(self.read_symbol_table().index) == symbols
+        stored_dict: Dict[str, pd.DataFrame] = dict()
+        start_date = None
+        if incremental:
+            stored_dict = self.load_fields(symbols, ohlcv_fields)
+            if stored_dict['Close'].shape[0] > 0:
+                # the last stored bar may be for a partial period, so the daily data is read from the start of
+                # that period
+                last_period = stored_dict['Close'].index[-1:].to_period(self.timeframe.value)[0]
+                start_date = last_period.start_time.to_pydatetime()
+                for field in ohlcv_fields:
+                    stored_dict[field] = stored_dict[field][stored_dict[field].index < start_date]
+        daily_dict = self.daily_store.load_fields(symbols, ohlcv_fields, start_date=start_date)
+        bar_dict = resample_bars(daily_dict, self.timeframe)
+        if start_date is not None:
+            for field in ohlcv_fields:
+                bar_dict[field] = pd.concat([stored_dict[field], bar_dict[field]], axis=0)
+        if not os.access(self.panel_path, os.R_OK):
+            os.makedirs(self.panel_path)
+        np.save(self.dates_file_path, np.array(bar_dict['Close'].index.values, dtype='datetime64[D]'))
+        for field in ohlcv_fields:
+            save_field(self.field_file_prefix(field), field, bar_dict[field].values.astype('float64'))
+        close_df = bar_dict['Close']
+        last_date_l = [close_df[sym].last_valid_index() for sym in symbols]
+        last_date_l = [last_ix.strftime('%Y-%m-%d') if last_ix is not None else '' for last_ix in last_date_l]
+        pd.DataFrame({'symbol': symbols, 'last_date': last_date_l}).to_csv(self.symbols_file_path, index=False)
+        source_last_date = str(daily_dates_a[-1]) if daily_dates_a.shape[0] > 0 else ''
+        pd.DataFrame({'num_rows': [daily_dates_a.shape[0]], 'last_date': [source_last_date]}).to_csv(
+            self.source_file_path, index=False)
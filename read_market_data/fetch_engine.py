@@ -0,0 +1,105 @@
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class TokenBucket:
+    """
+    A thread safe token bucket rate limiter. Tokens are added at rate tokens per second, up to capacity.
+    Each request takes one token and blocks until a token is available.
+    """
+
+    def __init__(self, rate: float, capacity: int):
+        """
+        :param rate: the number of tokens added per second. A rate <= 0 disables rate limiting.
+        :param capacity: the maximum number of tokens (the largest burst of requests)
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.last_time = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        if self.rate > 0:
+            while True:
+                with self.lock:
+                    now = time.monotonic()
+                    self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.rate)
+                    self.last_time = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        break
+                    wait_time = (1 - self.tokens) / self.rate
+                time.sleep(wait_time)
+
+
+class FetchEngine:
+    """
+    Run I/O bound fetch tasks (network downloads and file appends) on a pool of threads.
+
+    The threads share one requests.Session, so HTTP connections are reused. The number of tasks in flight is
+    limited by max_workers, the request rate is limited by a token bucket and a task that raises an exception
+    is retried with exponential backoff.
+    """
+
+    def __init__(self,
+                 max_workers: int = 8,
+                 rate: float = 4.0,
+                 burst: int = 8,
+                 max_retries: int = 3,
+                 backoff: float = 0.5):
+        """
+        :param max_workers: the maximum number of concurrent tasks
+        :param rate: the maximum number of requests per second (<= 0 for no limit)
+        :param burst: the number of requests that can be made at once before the rate limit applies
+        :param max_retries: the number of times a failed task is retried
+        :param backoff: the delay, in seconds, before the first retry. The delay doubles on each retry.
+        """
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.rate_limiter = TokenBucket(rate=rate, capacity=burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def run_task(self, fetch_fn: Callable, task):
+        """
+        Run one task, retrying with exponential backoff (plus a small random jitter) if it fails.
+
+        :return: the result of fetch_fn(task) or None if all of the attempts failed
+        """
+        result = None
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                result = fetch_fn(task)
+                break
+            except Exception as e:
+                if attempt < self.max_retries:
+                    delay = self.backoff * (2 ** attempt)
+                    time.sleep(delay + random.uniform(0, delay / 2))
+                else:
+                    print(f'FetchEngine: task {task} failed after {attempt + 1} attempts: {e}')
+        return result
+
+    def map(self, fetch_fn: Callable, tasks: List) -> List:
+        """
+        Apply fetch_fn to each task on the thread pool.
+
+        :return: the results in the same order as tasks (None for tasks that failed)
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(lambda task: self.run_task(fetch_fn, task), tasks))
+        return results
+
+    def close(self) -> None:
+        self.session.close()
@@ -0,0 +1,228 @@
+
+import os
+import shutil
+from datetime import datetime, date
+from typing import List, Dict, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+from read_market_data.market_data_provider import MarketDataProvider, ohlcv_fields, split_market_data
+from read_market_data.panel_alignment import align_series
+from read_market_data.price_codec import load_field, save_field
+from utils.convert_date import convert_datetime
+
+
+class IntradayBarStore:
+    """
+    An on-disk store for intraday (e.g., one minute) bars that is partitioned by trading day.
+
+    Each trading day is a directory, named YYYY-MM-DD, under <path>/intraday/<interval>. A partition has
+    the same layout as the daily price panel (see read_market_data.price_panel.PricePanelStore):
+
+      timestamps.npy - a datetime64[ns] vector with the bar timestamps (exchange local time) for the day
+      symbols.csv    - the symbols for the matrix columns
+      open, high, low, close, volume
+                     - one matrix (timestamps x symbols) per field. The prices are stored as delta encoded
+                       cents in a compressed .npz file (or as int32 cents in a .npy file) and the volume as
+                       float64 (see read_market_data.price_codec).
+
+    A load only opens the partitions that overlap the requested time range and only reads the requested
+    fields and symbols. iter_days() yields one day at a time, so years of minute bars for hundreds of
+    symbols never have to be in memory at once.
+    """
+    intraday_dir_name = 'intraday'
+    timestamps_file_name = 'timestamps.npy'
+    symbols_file_name = 'symbols.csv'
+
+    def __init__(self, path: str, interval: str = '1m', delta_encode: bool = True):
+        """
+        :param path: the market data directory (e.g., s_and_p_data)
+        :param interval: the bar size. Each interval is stored separately.
+        :param delta_encode: if True, the prices in new partitions are stored as delta encoded cents in
+                             compressed files. Otherwise they are stored as int32 cents.
+        """
+        self.path = path
+        self.interval = interval
+        self.delta_encode = delta_encode
+        self.store_path = path + os.path.sep + self.intraday_dir_name + os.path.sep + interval
+
+    def day_path(self, day: date) -> str:
+        return self.store_path + os.path.sep + day.strftime('%Y-%m-%d')
+
+    def field_file_prefix(self, day: date, field: str) -> str:
+        return self.day_path(day) + os.path.sep + field.lower()
+
+    def has_day(self, day: date) -> bool:
+        day_path = self.day_path(day)
+        return os.access(day_path + os.path.sep + self.timestamps_file_name, os.R_OK) and \
+               os.access(day_path + os.path.sep + self.symbols_file_name, os.R_OK)
+
+    def days(self, start_time: datetime = None, end_time: datetime = None) -> List[date]:
+        """
+        :param start_time: the start of the time range (inclusive) or None for the first partition
+        :param end_time: the end of the time range (exclusive) or None for the last partition
+        :return: the sorted trading days of the stored partitions that overlap the time range
+        """
+        # the bounds keep their time of day (e.g., a string, Timestamp or numpy.datetime64 from a bar index)
+        start_time = convert_datetime(start_time) if start_time is not None else None
+        end_time = convert_datetime(end_time) if end_time is not None else None
+        day_l: List[date] = list()
+        if os.access(self.store_path, os.R_OK):
+            for dir_name in os.listdir(self.store_path):
+                try:
+                    day = datetime.strptime(dir_name, '%Y-%m-%d').date()
+                except ValueError:
+                    continue
+                if start_time is not None and day < start_time.date():
+                    continue
+                if end_time is not None and datetime(*day.timetuple()[:3]) >= end_time:
+                    continue
+                if self.has_day(day):
+                    day_l.append(day)
+        day_l.sort()
+        return day_l
+
+    def read_day(self, day: date, stock_list: List[str], fields: List[str]) -> Dict[str, pd.DataFrame]:
+        """
+        Read the requested fields and symbols from one partition. The field files are memory mapped, so only
+        the requested columns are read.
+
+        :return: a dictionary of field -> DataFrame (timestamps x symbols). Symbols that are not in the
+                 partition are not included.
+        """
+        day_path = self.day_path(day)
+        timestamps_a = np.load(day_path + os.path.sep + self.timestamps_file_name)
+        symbols_df = pd.read_csv(day_path + os.path.sep + self.symbols_file_name, keep_default_na=False)
+        col_ix = {sym: ix for ix, sym in enumerate(symbols_df['symbol'])}
+        symbols = [sym for sym in stock_list if sym in col_ix]
+        symbol_ix = [col_ix[sym] for sym in symbols]
+        index = pd.DatetimeIndex(timestamps_a, name='Date')
+        field_dict: Dict[str, pd.DataFrame] = dict()
+        for field in fields:
+            field_m = load_field(self.field_file_prefix(day, field), slice(None), symbol_ix)
+            field_dict[field] = pd.DataFrame(field_m, index=index, columns=symbols)
+        return field_dict
+
+    def write_day(self, day: date, symbol_dict: Dict[str, pd.DataFrame]) -> None:
+        """
+        Write the partition for a day.
+
+        :param symbol_dict: a dictionary of symbol -> DataFrame with the bars for the day (a DatetimeIndex
+                            and one column per field)
+        """
+        symbols = list(symbol_dict.keys())
+        fields_l = [symbol_dict[sym].reindex(columns=ohlcv_fields).astype('float64') for sym in symbols]
+        timestamps_a, close_m = align_series([fields_df['Close'] for fields_df in fields_l], date_unit='ns')
+        # the partition is written to a temporary directory and then renamed, so that a reader never sees a
+        # partially written day
+        day_path = self.day_path(day)
+        tmp_path = day_path + '.tmp'
+        if os.access(tmp_path, os.R_OK):
+            shutil.rmtree(tmp_path)
+        os.makedirs(tmp_path)
+        np.save(tmp_path + os.path.sep + self.timestamps_file_name, timestamps_a)
+        pd.DataFrame(symbols, columns=['symbol']).to_csv(tmp_path + os.path.sep + self.symbols_file_name, index=False)
+        for field in ohlcv_fields:
+            if field == 'Close':
+                field_m = close_m
+            else:
+                _, field_m = align_series([fields_df[field] for fields_df in fields_l], timestamps_a, 'ns')
+            save_field(tmp_path + os.path.sep + field.lower(), field, field_m, self.delta_encode)
+        if os.access(day_path, os.R_OK):
+            shutil.rmtree(day_path)
+        os.rename(tmp_path, day_path)
+
+    def store_bars(self, symbol_dict: Dict[str, pd.DataFrame]) -> int:
+        """
+        Store intraday bars, merging them into the partitions for their trading days. A new bar replaces
+        a stored bar with the same symbol and timestamp.
+
+        :param symbol_dict: a dictionary of symbol -> DataFrame with a DatetimeIndex and one column per field
+        :return: the number of partitions that were written
+        """
+        day_groups: Dict[date, Dict[str, pd.DataFrame]] = dict()
+        for sym, bars_df in symbol_dict.items():
+            if bars_df.shape[0] > 0:
+                day_a = bars_df.index.normalize()
+                for day_ts in day_a.unique():
+                    day_groups.setdefault(day_ts.date(), dict())[sym] = bars_df[day_a == day_ts]
+        for day, new_dict in day_groups.items():
+            day_dict: Dict[str, pd.DataFrame] = dict()
+            if self.has_day(day):
+                stored_dict = self.read_day(day, self.day_symbols(day), ohlcv_fields)
+                for sym in stored_dict['Close'].columns:
+                    stored_df = pd.DataFrame({field: stored_dict[field][sym] for field in ohlcv_fields})
+                    day_dict[sym] = stored_df.dropna(subset=['Close'])
+            for sym, bars_df in new_dict.items():
+                bars_df = bars_df.reindex(columns=ohlcv_fields)
+                if sym in day_dict:
+                    bars_df = bars_df.combine_first(day_dict[sym])
+                day_dict[sym] = bars_df
+            self.write_day(day, day_dict)
+        return len(day_groups)
+
+    def day_symbols(self, day: date) -> List[str]:
+        symbols_df = pd.read_csv(self.day_path(day) + os.path.sep + self.symbols_file_name, keep_default_na=False)
+        return list(symbols_df['symbol'])
+
+    def fetch(self,
+              provider: MarketDataProvider,
+              symbols: List[str],
+              start_time: datetime,
+              end_time: datetime) -> int:
+        """
+        Download the intraday bars for the symbols (e.g., with YahooProvider(interval='1m')) and store them.
+
+        :return: the number of partitions that were written
+        """
+        panel_data = provider.download(symbols, start_time, end_time)
+        symbol_dict = split_market_data(panel_data, symbols, intraday=True)
+        return self.store_bars(symbol_dict)
+
+    def iter_days(self,
+                  stock_list: List[str],
+                  start_time: datetime,
+                  end_time: datetime,
+                  fields: List[str] = None) -> Iterator[Tuple[date, Dict[str, pd.DataFrame]]]:
+        """
+        Stream the bars in the time range [start_time, end_time), one trading day at a time.
+
+        :param start_time: the start of the time range (a str, datetime, Timestamp or numpy.datetime64)
+        :param end_time: the end of the time range
+        :param fields: the fields to read (by default only 'Close')
+        :return: an iterator of (day, dictionary of field -> DataFrame (timestamps x symbols))
+        """
+        fields = fields if fields is not None else ['Close']
+        start_time = convert_datetime(start_time)
+        end_time = convert_datetime(end_time)
+        for day in self.days(start_time, end_time):
+            field_dict = self.read_day(day, stock_list, fields)
+            index = field_dict[fields[0]].index
+            mask = (index >= start_time) & (index < end_time)
+            if mask.any():
+                yield day, {field: field_df[mask] for field, field_df in field_dict.items()}
+
+    def load_window(self,
+                    stock_list: List[str],
+                    start_time: datetime,
+                    end_time: datetime,
+                    fields: List[str] = None) -> Dict[str, pd.DataFrame]:
+        """
+        Load the bars in the time range [start_time, end_time). Only the partitions that overlap the range
+        are read. For long ranges, iter_days() should be used so that the days are processed one at a time.
+
+        :return: a dictionary of field -> DataFrame (timestamps x symbols)
+        """
+        fields = fields if fields is not None else ['Close']
+        day_l: Dict[str, List[pd.DataFrame]] = {field: list() for field in fields}
+        for _, field_dict in self.iter_days(stock_list, start_time, end_time, fields):
+            for field in fields:
+                day_l[field].append(field_dict[field])
+        window_dict: Dict[str, pd.DataFrame] = dict()
+        for field in fields:
+            if len(day_l[field]) > 0:
+                window_dict[field] = pd.concat(day_l[field], axis=0)
+            else:
+                window_dict[field] = pd.DataFrame(columns=stock_list, dtype='float64')
+        return window_dict
@@ -0,0 +1,274 @@
+
+import inspect
+import io
+import os
+import threading
+from abc import abstractmethod
+from datetime import datetime
+from typing import List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+import requests
+import yfinance as yf
+from yfinance import shared as yf_shared
+
+# The daily bar fields that are stored for each symbol
+ohlcv_fields = ['Open', 'High', 'Low', 'Close', 'Volume']
+
+
+class MarketDataProvider:
+    """
+    The interface for a source of daily market data. A provider downloads the data for a list of symbols in
+    one request.
+    """
+
+    @abstractmethod
+    def download(self, symbols: List[str], start_date: datetime, end_date: datetime) -> pd.DataFrame:
+        """
+        :param symbols: the symbols to download
+        :param start_date: the first date (inclusive)
+        :param end_date: the end date (exclusive)
+        :return: a wide DataFrame with a DatetimeIndex and MultiIndex columns (field, symbol), where the fields
+                 are 'Open', 'High', 'Low', 'Close', ... An empty DataFrame if there is no data.
+        """
+        pass
+
+    def download_with_status(self,
+                             symbols: List[str],
+                             start_date: datetime,
+                             end_date: datetime) -> Tuple[pd.DataFrame, List[str]]:
+        """
+        Download the data and report the symbols that the source explicitly reported as having no data (e.g.,
+        an HTTP 404 for the symbol). A symbol that is only missing from the download is not reported. By
+        default, no symbols are reported.
+
+        :return: the DataFrame returned by download and the list of symbols with no data
+        """
+        return self.download(symbols, start_date, end_date), list()
+
+    def use_session(self, session: requests.Session) -> None:
+        """
+        Share a session (e.g., the FetchEngine session, with its connection pool). The session is only used by
+        providers that make HTTP requests and that were not given their own session.
+        """
+        pass
+
+
+class YahooProvider(MarketDataProvider):
+    """
+    Download market data from Yahoo Finance. Many tickers are requested in a single yf.download call.
+
+    yf.download keeps its results and errors in module globals (yfinance.shared), which each call resets, so
+    the downloads are serialized by a lock and yfinance's own threads are not used. yf.download does not raise
+    when a ticker fails: the ticker is missing from the result and the error is recorded in
+    yfinance.shared._ERRORS. A ticker that failed for any reason other than having no data raises an
+    exception, so that the fetch engine retries the request.
+    """
+
+    # the yfinance globals are shared by all of the providers
+    download_lock = threading.Lock()
+    # the yfinance error messages for a ticker that has no data (e.g., a delisted ticker)
+    no_data_messages = ['no data found', 'no price data found', 'delisted']
+    # yf.download only has a session parameter in yfinance 0.2 and later (not in the pinned 0.1.77), so the
+    # session is only passed when yf.download has the parameter
+    download_takes_session = 'session' in inspect.signature(yf.download).parameters
+
+    def __init__(self, session=None, interval: str = '1d'):
+        """
+        :param session: an optional requests.Session that is shared by the downloads. It is not used with
+                        versions of yfinance where yf.download does not take a session.
+        :param interval: the bar size (e.g., '1d' or '1m'). Yahoo only provides the recent history for
+                         intraday bars.
+        """
+        self.session = session
+        self.interval = interval
+
+    def use_session(self, session: requests.Session) -> None:
+        if self.session is None:
+            self.session = session
+
+    def is_no_data_error(self, error) -> bool:
+        error_str = str(error).lower()
+        return any(message in error_str for message in self.no_data_messages)
+
+    def download(self, symbols: List[str], start_date: datetime, end_date: datetime) -> pd.DataFrame:
+        panel_data, _ = self.download_with_status(symbols, start_date, end_date)
+        return panel_data
+
+    def download_with_status(self,
+                             symbols: List[str],
+                             start_date: datetime,
+                             end_date: datetime) -> Tuple[pd.DataFrame, List[str]]:
+        """
+        :return: the download and the symbols for which yfinance recorded a "no data" (e.g., delisted) error
+        """
+        kwargs = dict()
+        if self.session is not None and self.download_takes_session:
+            kwargs['session'] = self.session
+        with self.download_lock:
+            panel_data = yf.download(tickers=symbols, start=start_date, end=end_date, interval=self.interval,
+                                     progress=False, group_by='column', threads=False, **kwargs)
+            error_dict = dict(yf_shared._ERRORS)
+        failed_l = [sym for sym, error in error_dict.items() if not self.is_no_data_error(error)]
+        if len(failed_l) > 0:
+            raise RuntimeError(f'Yahoo download failed for {", ".join(failed_l)}: {error_dict[failed_l[0]]}')
+        if panel_data.shape[0] == 0 and len(error_dict) == 0:
+            raise RuntimeError(f'Yahoo returned no data and no errors for {", ".join(symbols)}')
+        if panel_data.shape[0] > 0 and not isinstance(panel_data.columns, pd.MultiIndex):
+            # a single ticker is returned with flat (field) columns
+            panel_data.columns = pd.MultiIndex.from_product([panel_data.columns, symbols])
+        no_data_l = [sym for sym in symbols if sym.upper() in error_dict or sym in error_dict]
+        return panel_data, no_data_l
+
+
+class CsvFileProvider(MarketDataProvider):
+    """
+    A provider that reads the market data from local CSV files (one file per symbol, with a Date column and
+    one column per field). This can be used to exercise the download path offline against fixture files.
+    """
+
+    def __init__(self, path: str):
+        """
+        :param path: the directory containing the <SYMBOL>.csv files
+        """
+        self.path = path
+
+    def download(self, symbols: List[str], start_date: datetime, end_date: datetime) -> pd.DataFrame:
+        panel_data, _ = self.download_with_status(symbols, start_date, end_date)
+        return panel_data
+
+    def download_with_status(self,
+                             symbols: List[str],
+                             start_date: datetime,
+                             end_date: datetime) -> Tuple[pd.DataFrame, List[str]]:
+        """
+        :return: the download and the symbols that do not have a CSV file
+        """
+        symbol_l: List[pd.DataFrame] = list()
+        no_data_l: List[str] = list()
+        for sym in symbols:
+            file_path = self.path + os.path.sep + sym.upper() + '.csv'
+            if os.access(file_path, os.R_OK):
+                sym_df = pd.read_csv(file_path, index_col='Date', parse_dates=True)
+                sym_df = sym_df[(sym_df.index >= start_date) & (sym_df.index < end_date)]
+                if sym_df.shape[0] > 0:
+                    sym_df.columns = pd.MultiIndex.from_product([sym_df.columns, [sym]])
+                    symbol_l.append(sym_df)
+            else:
+                no_data_l.append(sym)
+        panel_data = pd.DataFrame()
+        if len(symbol_l) > 0:
+            panel_data = pd.concat(symbol_l, axis=1).sort_index()
+        return panel_data, no_data_l
+
+
+class HttpCsvProvider(MarketDataProvider):
+    """
+    A provider that fetches one CSV document per symbol over HTTP. The document has a Date column and one
+    column per field. The requests share a session, so that connections are reused.
+    """
+
+    def __init__(self, url_template: str, session: requests.Session = None, timeout: float = 10.0):
+        """
+        :param url_template: the URL for a symbol, with {symbol}, {start} and {end} (YYYY-MM-DD) fields. For
+                             example: http://localhost:8000/{symbol}.csv?start={start}&end={end}
+        :param session: the session that is shared by the requests. If it is None, the session from
+                        use_session (e.g., the FetchEngine session) or a new session is used.
+        :param timeout: the request timeout in seconds
+        """
+        self.url_template = url_template
+        self.session = session if session is not None else requests.Session()
+        self.own_session = session is None
+        self.timeout = timeout
+
+    def use_session(self, session: requests.Session) -> None:
+        if self.own_session:
+            self.session.close()
+            self.session = session
+            self.own_session = False
+
+    def download(self, symbols: List[str], start_date: datetime, end_date: datetime) -> pd.DataFrame:
+        panel_data, _ = self.download_with_status(symbols, start_date, end_date)
+        return panel_data
+
+    def download_with_status(self,
+                             symbols: List[str],
+                             start_date: datetime,
+                             end_date: datetime) -> Tuple[pd.DataFrame, List[str]]:
+        """
+        :return: the download and the symbols for which the server returned 404 (not found)
+        """
+        symbol_l: List[pd.DataFrame] = list()
+        no_data_l: List[str] = list()
+        for sym in symbols:
+            url = self.url_template.format(symbol=sym,
+                                           start=start_date.strftime('%Y-%m-%d'),
+                                           end=end_date.strftime('%Y-%m-%d'))
+            response = self.session.get(url, timeout=self.timeout)
+            if response.status_code == 404:
+                no_data_l.append(sym)
+                continue
+            # other errors raise an exception so that the fetch can be retried
+            response.raise_for_status()
+            sym_df = pd.read_csv(io.BytesIO(response.content), index_col='Date', parse_dates=True)
+            sym_df = sym_df[(sym_df.index >= start_date) & (sym_df.index < end_date)]
+            if sym_df.shape[0] > 0:
+                sym_df.columns = pd.MultiIndex.from_product([sym_df.columns, [sym]])
+                symbol_l.append(sym_df)
+        panel_data = pd.DataFrame()
+        if len(symbol_l) > 0:
+            panel_data = pd.concat(symbol_l, axis=1).sort_index()
+        return panel_data, no_data_l
+
+
+def split_market_data(panel_data: pd.DataFrame,
+                      symbols: List[str],
+                      fields: List[str] = None,
+                      intraday: bool = False) -> Dict[str, pd.DataFrame]:
+    """
+    Split a wide, multi-ticker download into per-symbol DataFrames. The rounding and the date normalization
+    are applied to the whole matrix for each field at once.
+
+    For daily bars the index is normalized to the date. For intraday bars the timestamps are kept, in the
+    exchange's local time (without a time zone).
+
+    A row is kept for a symbol if it has a close price. The prices are rounded to two decimals. The volume
+    is stored as an integer if it has no missing values.
+
+    :param panel_data: the DataFrame returned by MarketDataProvider.download
+    :param symbols: the symbols that were requested
+    :param fields: the fields to extract (by default, the ohlcv_fields that are in the download)
+    :param intraday: True if the download has intraday bars
+    :return: a dictionary of symbol -> DataFrame with one column per field. Symbols without data are mapped
+             to an empty DataFrame.
+    """
+    symbol_dict: Dict[str, pd.DataFrame] = {sym: pd.DataFrame() for sym in symbols}
+    fields = fields if fields is not None else ohlcv_fields
+    if panel_data.shape[0] > 0 and 'Close' in panel_data.columns.get_level_values(0):
+        field_l = [field for field in fields if field in panel_data.columns.get_level_values(0)]
+        if intraday:
+            index = pd.DatetimeIndex(panel_data.index)
+            if index.tz is not None:
+                index = index.tz_localize(None)
+        else:
+            index = pd.to_datetime(panel_data.index.strftime('%Y-%m-%d'))
+        field_m_dict = dict()
+        for field in field_l:
+            field_df = panel_data[field].reindex(columns=symbols)
+            field_m = field_df.values.astype('float64')
+            if field != 'Volume':
+                field_m = np.round(field_m, 2)
+            field_m_dict[field] = field_m
+        close_df = panel_data['Close'].reindex(columns=symbols)
+        valid_m = ~np.isnan(close_df.values.astype('float64'))
+        for ix, sym in enumerate(symbols):
+            valid_a = valid_m[:, ix]
+            if valid_a.any():
+                sym_df = pd.DataFrame({field: field_m_dict[field][valid_a, ix] for field in field_l},
+                                      index=index[valid_a])
+                if 'Volume' in sym_df.columns and not sym_df['Volume'].isna().any():
+                    sym_df['Volume'] = sym_df['Volume'].astype('int64')
+                sym_df.index.name = 'Date'
+                symbol_dict[sym] = sym_df
+    return symbol_dict
@@ -0,0 +1,93 @@
+
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import List
+
+import pandas as pd
+
+from read_market_data.price_panel import PricePanelStore
+
+
+class NegativeCache:
+    """
+    A persisted record of the symbols that the market data source reported as having no data (e.g., delisted or
+    renamed tickers), with the date range that was requested.
+
+    These requests are often the slowest to fail, so a symbol in the cache is not requested again until its
+    entry is older than the time to live (TTL). The cache is stored in the panel directory as
+    no_data_symbols.csv with the columns symbol, start_date, end_date and checked (the date of the request).
+    """
+    file_name = 'no_data_symbols.csv'
+    columns = ['symbol', 'start_date', 'end_date', 'checked']
+
+    def __init__(self, path: str, ttl_days: int = 7):
+        """
+        :param path: the directory for the per-symbol CSV files
+        :param ttl_days: the number of days an entry is used before the symbol is requested again. A TTL of 0
+                         disables the cache.
+        """
+        self.file_path = path + os.path.sep + PricePanelStore.panel_dir_name + os.path.sep + self.file_name
+        self.ttl = timedelta(days=ttl_days)
+        self.lock = threading.Lock()
+        self.entries: dict = dict()
+        self.modified = False
+        self.read()
+
+    def read(self) -> None:
+        if os.access(self.file_path, os.R_OK):
+            cache_df = pd.read_csv(self.file_path, keep_default_na=False)
+            for sym, start, end, checked in zip(cache_df['symbol'], cache_df['start_date'], cache_df['end_date'],
+                                                cache_df['checked']):
+                self.entries[sym] = (datetime.fromisoformat(start),
+                                     datetime.fromisoformat(end),
+                                     datetime.fromisoformat(checked))
+
+    def write(self) -> None:
+        """
+        Write the cache file if an entry was added or removed.
+        """
+        with self.lock:
+            if self.modified:
+                dir_path = os.path.dirname(self.file_path)
+                if not os.access(dir_path, os.R_OK):
+                    os.makedirs(dir_path)
+                self.report(active_only=False).to_csv(self.file_path, index=False)
+                self.modified = False
+
+    def is_active(self, checked: datetime) -> bool:
+        return datetime.today() - checked < self.ttl
+
+    def skip(self, symbol: str, start_date: datetime) -> bool:
+        """
+        :return: True if the symbol returned no data, within the TTL, for a request that started on or before
+                 start_date
+        """
+        skip_symbol = False
+        with self.lock:
+            if symbol in self.entries:
+                tried_start, _, checked = self.entries[symbol]
+                skip_symbol = self.is_active(checked) and tried_start <= start_date
+        return skip_symbol
+
+    def record(self, symbol: str, start_date: datetime, end_date: datetime) -> None:
+        with self.lock:
+            self.entries[symbol] = (start_date, end_date, datetime.today())
+            self.modified = True
+
+    def remove(self, symbol: str) -> None:
+        with self.lock:
+            if symbol in self.entries:
+                del self.entries[symbol]
+                self.modified = True
+
+    def report(self, active_only: bool = True) -> pd.DataFrame:
+        """
+        :param active_only: if True, only the entries within the TTL (the symbols that are skipped) are listed
+        :return: a DataFrame with the columns symbol, start_date, end_date and checked
+        """
+        rows: List[tuple] = list()
+        for sym, (start, end, checked) in sorted(self.entries.items()):
+            if not active_only or self.is_active(checked):
+                rows.append((sym, start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'), checked.strftime('%Y-%m-%d')))
+        return pd.DataFrame(rows, columns=self.columns)
@@ -0,0 +1,87 @@
+
+from enum import Enum
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+class MissingHistoryPolicy(Enum):
+    # Drop any symbol that is missing a value on a date in the calendar (the stocks with a shorter history)
+    DROP = 1
+    # Keep every symbol. Missing values are NaN.
+    KEEP = 2
+    # Drop the symbols whose coverage of the calendar is below a minimum fraction
+    MIN_COVERAGE = 3
+
+
+def align_series(series_l: List[pd.Series],
+                 calendar_a: np.ndarray = None,
+                 date_unit: str = 'D') -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Align a list of time series on the union of their dates. The union calendar is built once and each
+    series is written into a preallocated matrix, so the cost is linear in the number of values (plus the
+    sort for the calendar), rather than re-aligning a growing DataFrame for each series.
+
+    :param series_l: a list of Series with a DatetimeIndex
+    :param calendar_a: an optional calendar to align on (e.g., the calendar returned for another field of the
+                       same symbols). Every date in the series must be in this calendar.
+    :param date_unit: the resolution of the calendar. 'D' for daily bars, 'ns' keeps intraday timestamps.
+    :return: the calendar (a sorted datetime64 vector) and a float64 matrix (dates x series) where the
+             missing values are NaN.
+    """
+    dates_l = [np.asarray(series.index.values, dtype=f'datetime64[{date_unit}]') for series in series_l]
+    if calendar_a is None:
+        if len(dates_l) > 0:
+            calendar_a = np.unique(np.concatenate(dates_l))
+        else:
+            calendar_a = np.zeros(0, dtype=f'datetime64[{date_unit}]')
+    matrix = np.full((calendar_a.shape[0], len(series_l)), np.nan)
+    for col_ix, series in enumerate(series_l):
+        row_ix = np.searchsorted(calendar_a, dates_l[col_ix])
+        matrix[row_ix, col_ix] = series.values
+    return calendar_a, matrix
+
+
+def coverage_report(close_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    :param close_df: an aligned close price DataFrame (dates x symbols)
+    :return: a DataFrame indexed by symbol with the columns first_date, last_date, num_dates, missing and
+             coverage (the fraction of the calendar dates that have a value)
+    """
+    valid_m = ~np.isnan(close_df.values)
+    num_rows = valid_m.shape[0]
+    num_dates = valid_m.sum(axis=0)
+    dates_a = np.append(close_df.index.values, np.datetime64('NaT'))
+    # dates_a[num_rows] is NaT, which is used for the symbols without any data
+    first_ix = np.where(num_dates > 0, np.argmax(valid_m, axis=0), num_rows)
+    last_ix = np.where(num_dates > 0, num_rows - 1 - np.argmax(valid_m[::-1], axis=0), num_rows)
+    coverage_df = pd.DataFrame({'first_date': dates_a[first_ix],
+                                'last_date': dates_a[last_ix],
+                                'num_dates': num_dates,
+                                'missing': num_rows - num_dates,
+                                'coverage': num_dates / max(num_rows, 1)},
+                               index=close_df.columns)
+    return coverage_df
+
+
+def apply_missing_policy(close_df: pd.DataFrame,
+                         policy: MissingHistoryPolicy,
+                         min_coverage: float = 0.0) -> pd.DataFrame:
+    """
+    Select the symbols in an aligned close price DataFrame according to the missing history policy.
+
+    :param close_df: an aligned close price DataFrame (dates x symbols)
+    :param policy: the missing history policy
+    :param min_coverage: the minimum coverage (0..1) for the MIN_COVERAGE policy
+    :return: the DataFrame with the symbols that satisfy the policy
+    """
+    valid_m = ~np.isnan(close_df.values)
+    if policy == MissingHistoryPolicy.DROP:
+        keep_a = valid_m.all(axis=0)
+    elif policy == MissingHistoryPolicy.MIN_COVERAGE:
+        num_rows = max(valid_m.shape[0], 1)
+        keep_a = (valid_m.sum(axis=0) / num_rows) >= min_coverage
+    else:
+        keep_a = np.ones(valid_m.shape[1], dtype=bool)
+    return close_df.loc[:, keep_a]
@@ -0,0 +1,193 @@
+
+import hashlib
+import os
+from typing import List, Tuple
+
+import pandas as pd
+
+from read_market_data.MarketData import MarketData, read_s_and_p_stock_info, extract_sectors
+from read_market_data.price_matrix import ClosePriceMatrix
+from read_market_data.price_panel import PricePanelStore
+
+
+class PanelCache:
+    """
+    A cache for the fully aligned and filtered close price panel, together with the stock information
+    (Symbol, Name, Sector) for the stocks in the panel and the stocks grouped by sector.
+
+    A cache entry is keyed on the panel inputs (the symbol list, the stock information file, the start date
+    and the missing history policy) and on a fingerprint of the state (modification time and size) of the
+    stock information file and of every source CSV file. If none of these have changed, a start loads the
+    cache entry without parsing or aligning the per-symbol data. The close prices in a cache entry are stored
+    as a ClosePriceMatrix and are returned memory mapped.
+
+    The entries for different inputs (e.g., the pairs analysis and the backtest, which adds SPY) are kept side
+    by side. When a source file changes, the entry for the same inputs with the old fingerprint is stale and
+    is removed. At most max_entries entries are kept: the least recently used entry is removed.
+
+    Data that is derived from the panel (e.g., a correlation store) can be stored with the entry, under a name
+    from entry_store_name. These files are removed with the entry.
+    """
+    cache_dir_name = 'cache'
+    entry_prefix = 'panel_'
+    info_file_suffix = '_stock_info.csv'
+    # the maximum number of panels (e.g., for different symbol lists) in the cache
+    max_entries = 4
+
+    def __init__(self, market_data: MarketData):
+        self.market_data = market_data
+        self.panel_store = PricePanelStore(market_data.path)
+        self.cache_path = self.panel_store.panel_path + os.path.sep + self.cache_dir_name
+        # the key (<source key>_<fingerprint>) of the panel returned by the last get_panel call
+        self.key: str = None
+
+    def file_state(self, file_path: str) -> tuple:
+        state = (0, 0)
+        if os.access(file_path, os.R_OK):
+            stat = os.stat(file_path)
+            state = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def source_key(self, stock_list: List[str], stock_info_path: str) -> str:
+        """
+        :return: a hex digest that identifies the inputs to the panel, without the state of the files
+        """
+        hash_obj = hashlib.sha1()
+        hash_obj.update(self.market_data.start_date.strftime('%Y-%m-%d').encode())
+        hash_obj.update(f'{self.market_data.missing_policy.name}:{self.market_data.min_coverage}'.encode())
+        hash_obj.update(stock_info_path.encode())
+        for sym in sorted(stock_list):
+            hash_obj.update(sym.encode())
+        return hash_obj.hexdigest()[:16]
+
+    def fingerprint(self, stock_list: List[str], stock_info_path: str) -> str:
+        """
+        :return: a hex digest of the state of the stock information file and of the source files
+        """
+        hash_obj = hashlib.sha1()
+        hash_obj.update(f'{stock_info_path}:{self.file_state(stock_info_path)}'.encode())
+        for sym in sorted(stock_list):
+            hash_obj.update(f'{sym}:{self.panel_store.source_state(sym)}'.encode())
+        return hash_obj.hexdigest()[:16]
+
+    def entry_paths(self, key: str) -> Tuple[str, str]:
+        entry_name = self.entry_prefix + key
+        info_path = self.cache_path + os.path.sep + entry_name + self.info_file_suffix
+        sectors_path = self.cache_path + os.path.sep + entry_name + '_sectors.csv'
+        return info_path, sectors_path
+
+    def entry_keys(self) -> List[str]:
+        """
+        :return: the keys of the entries in the cache, from the least to the most recently used
+        """
+        key_l = list()
+        if os.access(self.cache_path, os.R_OK):
+            for file_name in os.listdir(self.cache_path):
+                if file_name.startswith(self.entry_prefix) and file_name.endswith(self.info_file_suffix):
+                    key_l.append(file_name[len(self.entry_prefix):-len(self.info_file_suffix)])
+        key_l.sort(key=lambda key: self.file_state(self.entry_paths(key)[0])[0])
+        return key_l
+
+    def remove_entry(self, key: str) -> None:
+        """
+        Remove the files for an entry, including the files that are derived from the panel.
+        """
+        if os.access(self.cache_path, os.R_OK):
+            for file_name in os.listdir(self.cache_path):
+                if file_name.startswith(self.entry_prefix + key):
+                    os.remove(self.cache_path + os.path.sep + file_name)
+
+    def remove_stale_entries(self, key: str) -> None:
+        """
+        Remove the entries for the same inputs as key with an old fingerprint and then the least recently used
+        entries, so that there is room for the entry for key.
+        """
+        source_key = key.split('_')[0]
+        key_l = list()
+        for entry_key in self.entry_keys():
+            if entry_key != key and entry_key.split('_')[0] == source_key:
+                self.remove_entry(entry_key)
+            else:
+                key_l.append(entry_key)
+        for entry_key in key_l[:max(len(key_l) - self.max_entries + 1, 0)]:
+            self.remove_entry(entry_key)
+
+    def write_entry(self, key: str, close_df: pd.DataFrame, stock_info_df: pd.DataFrame, sectors: dict) -> None:
+        self.remove_stale_entries(key)
+        close_matrix = ClosePriceMatrix(self.cache_path, self.entry_prefix + key)
+        close_matrix.write(close_df)
+        info_path, sectors_path = self.entry_paths(key)
+        stock_info_df.to_csv(info_path)
+        sector_rows = [(sector, sym) for sector, sym_l in sectors.items() for sym in sym_l]
+        pd.DataFrame(sector_rows, columns=['Sector', 'Symbol']).to_csv(sectors_path, index=False)
+
+    def read_entry(self, key: str) -> Tuple[pd.DataFrame, pd.DataFrame, dict]:
+        close_matrix = ClosePriceMatrix(self.cache_path, self.entry_prefix + key)
+        close_matrix.open()
+        close_df = close_matrix.window_df(0, close_matrix.shape()[0])
+        info_path, sectors_path = self.entry_paths(key)
+        # the modification time of the stock information file records when the entry was last used
+        os.utime(info_path)
+        stock_info_df = pd.read_csv(info_path, index_col=0, keep_default_na=False)
+        sectors_df = pd.read_csv(sectors_path, keep_default_na=False)
+        sectors = dict()
+        for sector, sym in zip(sectors_df['Sector'], sectors_df['Symbol']):
+            sectors.setdefault(sector, list()).append(sym)
+        return close_df, stock_info_df, sectors
+
+    def entry_store_name(self, suffix: str) -> str:
+        """
+        :param suffix: the name of the derived data (e.g., 'pair_correlation_126')
+        :return: the name for files, in self.cache_path, that are derived from the panel returned by the last
+                 get_panel call
+        """
+        assert self.key is not None
+        return self.entry_prefix + self.key + '_' + suffix
+
+    def close_matrix(self) -> ClosePriceMatrix:
+        """
+        :return: the open (memory mapped) close price matrix for the panel returned by the last get_panel call
+        """
+        assert self.key is not None
+        close_matrix = ClosePriceMatrix(self.cache_path, self.entry_prefix + self.key)
+        close_matrix.open()
+        return close_matrix
+
+    def has_entry(self, key: str) -> bool:
+        info_path, sectors_path = self.entry_paths(key)
+        close_matrix = ClosePriceMatrix(self.cache_path, self.entry_prefix + key)
+        return close_matrix.has_files() and os.access(info_path, os.R_OK) and os.access(sectors_path, os.R_OK)
+
+    def get_panel(self, stock_info_path: str, extra_symbols: List[str] = None) -> Tuple[pd.DataFrame, pd.DataFrame, dict]:
+        """
+        Return the close prices for the stocks in the stock information file, the stock information for
+        the stocks that have close prices for the whole period and these stocks grouped by sector.
+
+        :param stock_info_path: the path to the file with the Symbol, Name and Sector for the stocks
+        :param extra_symbols: symbols that are not in the stock information file (e.g., 'SPY') that should
+                              be included in the close prices
+        :return: close_prices_df, final_stock_info_df, sectors (see read_market_data.MarketData.extract_sectors)
+        """
+        stock_info_df = read_s_and_p_stock_info(stock_info_path)
+        stock_l: list = list(set(stock_info_df['Symbol']))
+        if extra_symbols is not None:
+            stock_l.extend(extra_symbols)
+        stock_l.sort()
+        # bring the source files up to date before they are fingerprinted
+        self.market_data.refresh_stale_data(stock_l)
+        key = self.source_key(stock_l, stock_info_path) + '_' + self.fingerprint(stock_l, stock_info_path)
+        self.key = key
+        if self.has_entry(key):
+            close_prices_df, final_stock_info_df, sectors = self.read_entry(key)
+        else:
+            close_prices_df = self.market_data.get_close_data(stock_l, refresh=False)
+            mask = stock_info_df['Symbol'].isin(list(close_prices_df.columns))
+            # Some stocks were listed on the stock exchange later than start_date. final_stock_info_df has the
+            # Symbol, Name and Sector for the set of stocks that have close prices for the date range.
+            final_stock_info_df = stock_info_df[mask]
+            sectors = extract_sectors(final_stock_info_df)
+            self.write_entry(key, close_prices_df, final_stock_info_df, sectors)
+            # return the entry that was just written, so a cold start returns the same (memory mapped, read
+            # only) frames as a warm start
+            close_prices_df, final_stock_info_df, sectors = self.read_entry(key)
+        return close_prices_df, final_stock_info_df, sectors
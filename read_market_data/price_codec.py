@@ -0,0 +1,137 @@
+
+import os
+
+import numpy as np
+
+# The prices are stored as int32 cents. Missing values (NaN) are stored as the smallest int32 value.
+missing_cents = np.iinfo(np.int32).min
+# The fields that are stored as cents. Other fields (e.g., Volume) are stored as float64.
+price_fields = ['Open', 'High', 'Low', 'Close']
+# A field without any values (e.g., the Open for close price only sources) is not stored. It is recorded in a
+# small file with the shape of the field matrix and is loaded as NaN values.
+absent_file_ext = '.absent.npy'
+# The prices that can be stored as int32 cents (the smallest int32 value is missing_cents)
+max_cents = np.iinfo(np.int32).max
+
+
+def encode_cents(price_m: np.ndarray) -> np.ndarray:
+    """
+    :param price_m: a float64 array of prices with (at most) two decimals. Missing values are NaN.
+    :return: an int32 array of cents, with missing_cents for the missing values
+    :raises ValueError: if a price is too large (or too small) to be stored as int32 cents
+    """
+    nan_m = np.isnan(price_m)
+    cents_m = np.rint(np.where(nan_m, 0, price_m) * 100)
+    out_of_range_m = ~(np.abs(cents_m) <= max_cents)
+    if out_of_range_m.any():
+        bad_price = price_m[out_of_range_m][0]
+        raise ValueError(f'encode_cents: the price {bad_price} is outside of the int32 cents range '
+                         f'(+/- {max_cents / 100:.2f})')
+    cents_m = cents_m.astype('int32')
+    cents_m[nan_m] = missing_cents
+    return cents_m
+
+
+def decode_cents(cents_m: np.ndarray) -> np.ndarray:
+    """
+    :return: a float64 array of prices with NaN for the missing values
+    """
+    price_m = cents_m.astype('float64') / 100
+    price_m[cents_m == missing_cents] = np.nan
+    return price_m
+
+
+def delta_encode(cents_m: np.ndarray) -> np.ndarray:
+    """
+    Delta encode an int32 cents array (time x symbols) along the time axis. Each value is replaced by its
+    difference from the previous non-missing value in its column. The differences are small, so the delta
+    encoded array compresses much better than the prices.
+    """
+    valid_m = cents_m != missing_cents
+    filled_m = np.where(valid_m, cents_m, 0).astype('int64')
+    # carry the last valid value forward over the missing values
+    row_ix = np.where(valid_m, np.arange(cents_m.shape[0]).reshape(-1, 1), 0)
+    np.maximum.accumulate(row_ix, axis=0, out=row_ix)
+    prev_m = np.take_along_axis(filled_m, row_ix, axis=0)
+    delta_m = np.zeros(cents_m.shape, dtype='int64')
+    if cents_m.shape[0] > 0:
+        delta_m[0] = filled_m[0]
+        delta_m[1:] = filled_m[1:] - prev_m[:-1]
+    delta_m = delta_m.astype('int32')
+    delta_m[~valid_m] = missing_cents
+    return delta_m
+
+
+def delta_decode(delta_m: np.ndarray) -> np.ndarray:
+    """
+    :return: the int32 cents array for a delta encoded array
+    """
+    valid_m = delta_m != missing_cents
+    cents_m = np.cumsum(np.where(valid_m, delta_m, 0), axis=0, dtype='int64').astype('int32')
+    cents_m[~valid_m] = missing_cents
+    return cents_m
+
+
+def save_field(file_prefix: str, field: str, field_m: np.ndarray, delta: bool = False) -> None:
+    """
+    Save a field matrix. The prices are stored as int32 cents in a .npy file that can be memory mapped or,
+    if delta is True, as delta encoded cents in a compressed .npz file. Other fields are stored as float64.
+
+    The matrix (dates x symbols) is stored in column-major (Fortran) order, so the dates for a symbol are
+    contiguous in the file. Loading a date range for a few symbols then reads one contiguous run per symbol,
+    rather than touching every row of the file.
+
+    A field that is entirely missing is not stored. Only its shape is recorded (see absent_file_ext).
+
+    :param file_prefix: the path of the field file without the extension
+    :param field_m: the field values (dates x symbols)
+    """
+    remove_field(file_prefix)
+    if np.isnan(field_m).all():
+        np.save(file_prefix + absent_file_ext, np.array(field_m.shape, dtype='int64'))
+    elif field in price_fields:
+        cents_m = encode_cents(field_m)
+        if delta:
+            np.savez_compressed(file_prefix + '.npz', delta=np.asfortranarray(delta_encode(cents_m)))
+        else:
+            np.save(file_prefix + '.npy', np.asfortranarray(cents_m))
+    else:
+        np.save(file_prefix + '.npy', np.asfortranarray(field_m))
+
+
+def remove_field(file_prefix: str) -> None:
+    """
+    Remove the stored files for a field (in any of the formats), so that a field that is written in a
+    different format does not leave a stale file behind.
+    """
+    for ext in ['.npy', '.npz', absent_file_ext]:
+        if os.access(file_prefix + ext, os.R_OK):
+            os.remove(file_prefix + ext)
+
+
+def has_field(file_prefix: str) -> bool:
+    return os.access(file_prefix + '.npy', os.R_OK) or os.access(file_prefix + '.npz', os.R_OK) or \
+           os.access(file_prefix + absent_file_ext, os.R_OK)
+
+
+def load_field(file_prefix: str, row_slice: slice, col_ix: list) -> np.ndarray:
+    """
+    Load the rows and columns of a field matrix and decode them into a float64 array. A .npy file is memory
+    mapped, so only the requested rows and columns are read: for each column, a contiguous run of the file.
+    A delta encoded file is decoded in full. float64 .npy files (written before the cents encoding) are
+    read as they are. Files that were written in row-major order (before the column-major layout) are read
+    correctly, but each requested column touches every row, until the file is rebuilt. A field that was
+    recorded as absent is returned as NaN values, without reading any data.
+    """
+    if os.access(file_prefix + absent_file_ext, os.R_OK):
+        num_rows = int(np.load(file_prefix + absent_file_ext)[0])
+        field_m = np.full((len(range(*row_slice.indices(num_rows))), len(col_ix)), np.nan)
+    elif os.access(file_prefix + '.npz', os.R_OK):
+        with np.load(file_prefix + '.npz') as npz_file:
+            field_m = decode_cents(delta_decode(npz_file['delta'])[row_slice][:, col_ix])
+    else:
+        stored_m = np.load(file_prefix + '.npy', mmap_mode='r')
+        field_m = np.ascontiguousarray(stored_m[row_slice, col_ix])
+        if field_m.dtype == np.int32:
+            field_m = decode_cents(field_m)
+    return field_m
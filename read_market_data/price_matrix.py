@@ -0,0 +1,114 @@
+
+import os
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from read_market_data.validity_mask import ValidityMask
+from utils.trading_calendar import TradingCalendar
+
+class ClosePriceMatrix:
+    """
+    A memory mapped close price matrix (dates x symbols) with a date index sidecar.
+
+    The matrix is written once as a contiguous float64 .npy file and then opened with numpy.memmap. Every
+    process that opens the matrix shares the same physical pages (the operating system page cache), so
+    worker processes do not need their own copy of the price history. Windows (row ranges) and per-symbol
+    columns are returned as NumPy views of the mapped file, so extracting a window does not copy the data.
+
+    Files, where <name> is the matrix name:
+      <name>.npy         - the float64 close price matrix
+      <name>_dates.npy   - the datetime64 date (or intraday timestamp) index for the matrix rows
+      <name>_symbols.csv - the symbols for the matrix columns
+    """
+
+    def __init__(self, path: str, name: str = 'close_matrix'):
+        """
+        :param path: the directory for the matrix files
+        :param name: the name of the matrix. This is the prefix for the file names.
+        """
+        self.path = path
+        self.name = name
+        self.matrix_file_path = path + os.path.sep + name + '.npy'
+        self.dates_file_path = path + os.path.sep + name + '_dates.npy'
+        self.symbols_file_path = path + os.path.sep + name + '_symbols.csv'
+        self.prices: np.ndarray = np.zeros((0, 0))
+        self.index: pd.DatetimeIndex = pd.DatetimeIndex([])
+        self.symbols: List[str] = list()
+        self.col_ix: dict = dict()
+        self.validity: ValidityMask = None
+        self.calendar: TradingCalendar = TradingCalendar(self.index)
+
+    def has_files(self) -> bool:
+        return os.access(self.matrix_file_path, os.R_OK) and \
+               os.access(self.dates_file_path, os.R_OK) and \
+               os.access(self.symbols_file_path, os.R_OK)
+
+    def write(self, close_df: pd.DataFrame) -> None:
+        """
+        Write a close price DataFrame (DatetimeIndex rows and one column per symbol) as a matrix file.
+        """
+        if not os.access(self.path, os.R_OK):
+            os.makedirs(self.path)
+        # the dates are stored at nanosecond resolution, so intraday timestamps are kept
+        dates_a = np.array(close_df.index.values, dtype='datetime64[ns]')
+        np.save(self.matrix_file_path, np.ascontiguousarray(close_df.values, dtype='float64'))
+        np.save(self.dates_file_path, dates_a)
+        pd.DataFrame(list(close_df.columns), columns=['symbol']).to_csv(self.symbols_file_path, index=False)
+
+    def open(self) -> None:
+        """
+        Memory map the matrix file (read only) and read the date index and symbol sidecars.
+        """
+        self.prices = np.load(self.matrix_file_path, mmap_mode='r')
+        dates_a = np.load(self.dates_file_path)
+        self.index = pd.DatetimeIndex(dates_a.astype('datetime64[ns]'), name='Date')
+        # the date -> row index lookups for the matrix
+        self.calendar = TradingCalendar(self.index)
+        symbols_df = pd.read_csv(self.symbols_file_path, keep_default_na=False)
+        self.symbols = list(symbols_df['symbol'])
+        self.col_ix = {sym: ix for ix, sym in enumerate(self.symbols)}
+        self.validity = None
+
+    def shape(self) -> tuple:
+        return self.prices.shape
+
+    def validity_mask(self) -> ValidityMask:
+        """
+        :return: the validity mask for the matrix (built on the first call), which is used to select the
+                 symbols that have prices for a whole window when the histories are ragged.
+        """
+        if self.validity is None:
+            self.validity = ValidityMask(self.prices, self.symbols)
+        return self.validity
+
+    def window(self, start_ix: int, end_ix: int) -> np.ndarray:
+        """
+        :return: a view of the rows start_ix:end_ix for all of the symbols
+        """
+        return self.prices[start_ix:end_ix]
+
+    def column(self, symbol: str, start_ix: int, end_ix: int) -> np.ndarray:
+        """
+        :return: a (strided) view of the rows start_ix:end_ix for one symbol
+        """
+        return self.prices[start_ix:end_ix, self.col_ix[symbol]]
+
+    def window_df(self, start_ix: int, end_ix: int) -> pd.DataFrame:
+        """
+        :return: a DataFrame, with the symbols as columns, that wraps the window view without copying it.
+        """
+        window_df = pd.DataFrame(self.window(start_ix, end_ix),
+                                 index=self.index[start_ix:end_ix],
+                                 columns=self.symbols,
+                                 copy=False)
+        return window_df
+
+    def column_df(self, symbol: str, start_ix: int, end_ix: int) -> pd.DataFrame:
+        """
+        :return: a single column DataFrame (the column name is the symbol) that wraps the column view.
+        """
+        column_a = self.column(symbol, start_ix, end_ix).reshape(-1, 1)
+        column_df = pd.DataFrame(column_a, index=self.index[start_ix:end_ix], columns=[symbol], copy=False)
+        return column_df
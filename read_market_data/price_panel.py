@@ -0,0 +1,284 @@
+import io
+import os
+from datetime import datetime
+from typing import List, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+from read_market_data.market_data_provider import ohlcv_fields
+from read_market_data.panel_alignment import align_series
+from read_market_data.price_codec import has_field, load_field, save_field
+
+
+class PricePanelStore:
+    """
+    A consolidated, on-disk copy of the daily price panel that is built from the per-symbol CSV files.
+
+    The per-symbol CSV files (e.g., s_and_p_data/AAPL.csv) remain the import/export format. The panel store
+    is derived from them and is only rebuilt when one of the source files changes. The store consists of:
+
+      dates.npy   - a datetime64[D] vector with the union of the trading dates
+      symbols.csv - the symbol table. Row i describes column i of the field matrices and records the
+                    state (modification time and size) of the source CSV when the panel was built.
+      open.npy, high.npy, low.npy, close.npy, volume.npy
+                  - one matrix (dates x symbols) per OHLCV field, stored in column-major order, so the dates
+                    for a symbol are contiguous. The prices are stored as int32 cents and the volume as
+                    float64 (see read_market_data.price_codec). The prices are decoded into float64 arrays,
+                    with NaN for the missing values, when they are loaded. A field without any data (e.g., the
+                    open, high, low and volume when the source files only have close prices) is not stored.
+                    It is recorded as absent (e.g., open.absent.npy) and is loaded as NaN values.
+
+    Each field is in a separate file, so a load only reads the fields that are requested. The close only
+    loads read the same amount of data as a close only store. A load for a subset of the symbols reads one
+    contiguous run of the file for each symbol.
+    """
+    panel_dir_name = 'panel'
+    dates_file_name = 'dates.npy'
+    symbols_file_name = 'symbols.csv'
+
+    def __init__(self, csv_path: str):
+        """
+        :param csv_path: the directory that contains the per-symbol CSV files
+        """
+        self.csv_path = csv_path
+        self.panel_path = csv_path + os.path.sep + self.panel_dir_name
+        self.dates_file_path = self.panel_path + os.path.sep + self.dates_file_name
+        self.symbols_file_path = self.panel_path + os.path.sep + self.symbols_file_name
+
+    def field_file_prefix(self, field: str) -> str:
+        """
+        :return: the path of the file for a field, without the extension (see read_market_data.price_codec)
+        """
+        path: str = self.panel_path + os.path.sep + field.lower()
+        return path
+
+    def symbol_file_path(self, symbol: str) -> str:
+        path: str = self.csv_path + os.path.sep + symbol.upper() + '.csv'
+        return path
+
+    def has_files(self) -> bool:
+        files_exist = False
+        if os.access(self.panel_path, os.R_OK):
+            files_exist = os.access(self.dates_file_path, os.R_OK) and \
+                          os.access(self.symbols_file_path, os.R_OK) and \
+                          all(has_field(self.field_file_prefix(field)) for field in ohlcv_fields)
+        return files_exist
+
+    def source_state(self, symbol: str) -> tuple:
+        """
+        :return: a tuple with the modification time (in nanoseconds) and the size of the symbol's CSV file
+                 or (0, 0) if the file does not exist.
+        """
+        state = (0, 0)
+        file_path = self.symbol_file_path(symbol)
+        if os.access(file_path, os.R_OK):
+            stat = os.stat(file_path)
+            state = (stat.st_mtime_ns, stat.st_size)
+        return state
+
+    def read_symbol_table(self) -> pd.DataFrame:
+        symbol_table = pd.DataFrame()
+        if self.has_files():
+            symbol_table = pd.read_csv(self.symbols_file_path, index_col='symbol', keep_default_na=False)
+        return symbol_table
+
+    def is_current(self, stock_list: List[str]) -> bool:
+        """
+        The panel is current if it contains every symbol in stock_list and none of the source CSV files
+        have changed since the panel was built.
+        """
+        current = False
+        symbol_table = self.read_symbol_table()
+        if symbol_table.shape[0] > 0 and all(sym in symbol_table.index for sym in stock_list):
+            current = True
+            for sym in stock_list:
+                row = symbol_table.loc[sym]
+                if self.source_state(sym) != (row['mtime_ns'], row['size']):
+                    current = False
+                    break
+        return current
+
+    def last_dates(self, stock_list: List[str]) -> dict:
+        """
+        :return: a dictionary of symbol -> the last date with data in the stored panel. Symbols that are not in
+                 the panel (or that have no data) are not included.
+        """
+        last_date_dict = dict()
+        symbol_table = self.read_symbol_table()
+        for sym in stock_list:
+            if sym in symbol_table.index:
+                last_date_str = symbol_table.loc[sym, 'last_date']
+                if len(last_date_str) > 0:
+                    last_date_dict[sym] = datetime.fromisoformat(last_date_str)
+        return last_date_dict
+
+    def csv_fields(self, symbol_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        :param symbol_df: the rows read from a symbol CSV file
+        :return: a float64 DataFrame with the ohlcv_fields as columns. A file with a single, unnamed, price
+                 column is treated as a close price file. The fields that are not in the file are NaN.
+        """
+        if 'Close' not in symbol_df.columns and symbol_df.shape[1] > 0:
+            symbol_df = symbol_df.rename(columns={symbol_df.columns[0]: 'Close'})
+        fields_df = symbol_df.reindex(columns=ohlcv_fields).astype('float64')
+        return fields_df
+
+    def read_symbol_csv(self, symbol: str) -> pd.DataFrame:
+        fields_df = pd.DataFrame(columns=ohlcv_fields, dtype='float64')
+        file_path = self.symbol_file_path(symbol)
+        if os.access(file_path, os.R_OK):
+            symbol_df = pd.read_csv(file_path, index_col='Date', parse_dates=True)
+            if symbol_df.shape[0] > 0:
+                fields_df = self.csv_fields(symbol_df)
+        return fields_df
+
+    def read_appended_rows(self, symbol: str, offset: int) -> pd.DataFrame:
+        """
+        Read the rows that were appended to a symbol CSV file after the byte offset.
+        """
+        file_path = self.symbol_file_path(symbol)
+        with open(file_path, 'rb') as csv_file:
+            header = csv_file.readline().decode().strip().split(',')
+            csv_file.seek(offset)
+            appended = csv_file.read()
+        rows_df = pd.read_csv(io.BytesIO(appended), header=None, names=header, index_col='Date', parse_dates=True)
+        return self.csv_fields(rows_df)
+
+    def update_symbol(self, symbol: str, stored_df: pd.DataFrame, stored_row: pd.Series) -> pd.DataFrame:
+        """
+        Bring the stored fields for a symbol up to date with its source CSV file. Unchanged files
+        are not read. A file that only grew (the refresh appends rows) is read from the previous end of
+        the file. Any other change causes the whole file to be read.
+        """
+        fields_df = stored_df
+        mtime_ns, size = self.source_state(symbol)
+        if (mtime_ns, size) != (stored_row['mtime_ns'], stored_row['size']):
+            fields_df = pd.DataFrame(columns=ohlcv_fields, dtype='float64')
+            if size > stored_row['size'] > 0 and len(stored_row['last_date']) > 0:
+                appended_df = self.read_appended_rows(symbol, stored_row['size'])
+                if appended_df.shape[0] > 0 and appended_df.index[0] > datetime.fromisoformat(stored_row['last_date']):
+                    fields_df = pd.concat([stored_df, appended_df], axis=0)
+            if fields_df.shape[0] == 0:
+                fields_df = self.read_symbol_csv(symbol)
+        return fields_df
+
+    def build(self, stock_list: List[str]) -> None:
+        """
+        Update the consolidated panel from the source CSV files for the symbols in stock_list. Symbols
+        that were already in the panel are kept so that a smaller stock list does not discard data.
+        Only the source files that changed since the last build are read.
+        """
+        symbol_table = self.read_symbol_table()
+        stored_dict: Dict[str, pd.DataFrame] = dict()
+        if symbol_table.shape[0] > 0:
+            stored_dict = self.load_fields(list(symbol_table.index), ohlcv_fields)
+        symbols = list(symbol_table.index) + [sym for sym in stock_list if sym not in symbol_table.index]
+        symbol_l: List[pd.DataFrame] = list()
+        table_rows: List[tuple] = list()
+        for sym in symbols:
+            mtime_ns, size = self.source_state(sym)
+            if sym in symbol_table.index:
+                stored_df = pd.DataFrame({field: stored_dict[field][sym] for field in ohlcv_fields})
+                fields_df = self.update_symbol(sym, stored_df.dropna(subset=['Close']), symbol_table.loc[sym])
+            else:
+                fields_df = self.read_symbol_csv(sym)
+            valid_ix = fields_df['Close'].last_valid_index()
+            last_date = valid_ix.strftime('%Y-%m-%d') if valid_ix is not None else ''
+            symbol_l.append(fields_df)
+            table_rows.append((sym, mtime_ns, size, last_date))
+        # the calendar is built from the close prices and the other fields are aligned on it
+        dates_a, close_m = align_series([fields_df['Close'] for fields_df in symbol_l])
+        if not os.access(self.panel_path, os.R_OK):
+            os.makedirs(self.panel_path)
+        np.save(self.dates_file_path, dates_a)
+        for field in ohlcv_fields:
+            if field == 'Close':
+                field_m = close_m
+            else:
+                _, field_m = align_series([fields_df[field] for fields_df in symbol_l], dates_a)
+            save_field(self.field_file_prefix(field), field, field_m)
+        symbol_table = pd.DataFrame(table_rows, columns=['symbol', 'mtime_ns', 'size', 'last_date'])
+        symbol_table.to_csv(self.symbols_file_path, index=False)
+
+    def date_range_ix(self, dates_a: np.ndarray, start_date: datetime, end_date: datetime) -> Tuple[int, int]:
+        """
+        :return: the row range [start_ix, end_ix) of the dates in [start_date, end_date). A start_date or
+                 end_date of None leaves the range open at that end.
+        """
+        start_ix = 0
+        end_ix = dates_a.shape[0]
+        if start_date is not None:
+            start_ix = int(np.searchsorted(dates_a, np.datetime64(start_date, 'D'), side='left'))
+        if end_date is not None:
+            end_ix = int(np.searchsorted(dates_a, np.datetime64(end_date, 'D'), side='left'))
+        return start_ix, max(start_ix, end_ix)
+
+    def load_fields(self,
+                    stock_list: List[str],
+                    fields: List[str],
+                    start_date: datetime = None,
+                    end_date: datetime = None) -> Dict[str, pd.DataFrame]:
+        """
+        Load the requested fields from the panel. The field files are memory mapped and only the rows
+        in the date range and the columns for the symbols in stock_list are read. The fields that are not
+        requested are not read at all.
+
+        :param stock_list: the symbols
+        :param fields: a list of ohlcv_fields (e.g., ['Close', 'Volume'])
+        :param start_date: the first date (inclusive) or None for the start of the panel
+        :param end_date: the end date (exclusive) or None for the end of the panel
+        :return: a dictionary of field -> DataFrame with a DatetimeIndex and one column per symbol in
+                 stock_list (symbols that are not in the panel are not included). All of the DataFrames
+                 have the same index.
+        """
+        dates_a = np.load(self.dates_file_path)
+        start_ix, end_ix = self.date_range_ix(dates_a, start_date, end_date)
+        dates_a = dates_a[start_ix:end_ix]
+        symbol_table = self.read_symbol_table()
+        col_ix = {sym: ix for ix, sym in enumerate(symbol_table.index)}
+        symbols = [sym for sym in stock_list if sym in col_ix]
+        symbol_ix = [col_ix[sym] for sym in symbols]
+        field_m_dict = dict()
+        for field in fields:
+            field_m_dict[field] = load_field(self.field_file_prefix(field), slice(start_ix, end_ix), symbol_ix)
+        # The panel calendar is the union over all of the stored symbols. Remove the dates where none of the
+        # requested symbols have data.
+        valid_a = np.zeros(dates_a.shape[0], dtype=bool)
+        for field_m in field_m_dict.values():
+            valid_a |= ~np.isnan(field_m).all(axis=1)
+        index = pd.DatetimeIndex(dates_a[valid_a].astype('datetime64[ns]'), name='Date')
+        field_dict: Dict[str, pd.DataFrame] = dict()
+        for field, field_m in field_m_dict.items():
+            field_dict[field] = pd.DataFrame(field_m[valid_a], index=index, columns=symbols)
+        return field_dict
+
+    def load(self, stock_list: List[str], start_date: datetime = None, end_date: datetime = None) -> pd.DataFrame:
+        """
+        Load the close prices from the panel with one bulk read.
+
+        :param start_date: the first date (inclusive) or None for the start of the panel
+        :param end_date: the end date (exclusive) or None for the end of the panel
+        :return: a DataFrame with a DatetimeIndex and one column per symbol in stock_list (symbols that are
+                 not in the panel are not included).
+        """
+        close_df = self.load_fields(stock_list, ['Close'], start_date, end_date)['Close']
+        return close_df
+
+    def export_csv(self, path: str) -> None:
+        """
+        Write the panel out as one CSV file per symbol, in the same format as the source files. The fields
+        without any data for a symbol (e.g., a close price only source file) are not written.
+
+        :param path: the directory for the CSV files
+        """
+        if not os.access(path, os.R_OK):
+            os.makedirs(path)
+        symbol_table = self.read_symbol_table()
+        field_dict = self.load_fields(list(symbol_table.index), ohlcv_fields)
+        for sym in field_dict['Close'].columns:
+            symbol_df = pd.DataFrame({field: field_dict[field][sym] for field in ohlcv_fields})
+            symbol_df = symbol_df.dropna(subset=['Close']).dropna(axis='columns', how='all')
+            if 'Volume' in symbol_df.columns and not symbol_df['Volume'].isna().any():
+                symbol_df['Volume'] = symbol_df['Volume'].astype('int64')
+            symbol_df.to_csv(path + os.path.sep + sym.upper() + '.csv', index_label='Date')
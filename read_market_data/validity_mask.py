@@ -0,0 +1,56 @@
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+
+class ValidityMask:
+    """
+    The validity (non-NaN) mask for a panel with ragged histories (see MissingHistoryPolicy.KEEP), where
+    stocks start (or stop) trading on different dates.
+
+    The mask is stored as the running count of valid values for each symbol, so the symbols that have a
+    value on every date in a window [start_ix, end_ix) are found with one vectorized subtraction, without
+    scanning the window or rebuilding the price DataFrame.
+    """
+
+    def __init__(self, close_m: np.ndarray, symbols: List[str]):
+        """
+        :param close_m: the close prices (dates x symbols). Missing values are NaN.
+        :param symbols: the symbols for the columns of close_m
+        """
+        self.symbols = list(symbols)
+        self.col_ix = {sym: ix for ix, sym in enumerate(self.symbols)}
+        valid_count = np.zeros((close_m.shape[0] + 1, close_m.shape[1]), dtype='int32')
+        np.cumsum(~np.isnan(close_m), axis=0, out=valid_count[1:])
+        self.valid_count = valid_count
+
+    @classmethod
+    def from_frame(cls, close_df: pd.DataFrame):
+        return cls(close_df.values, list(close_df.columns))
+
+    def eligible(self, start_ix: int, end_ix: int) -> np.ndarray:
+        """
+        :return: a boolean vector (one element per symbol) that is True for the symbols with a value on
+                 every date in the window [start_ix, end_ix)
+        """
+        end_ix = min(end_ix, self.valid_count.shape[0] - 1)
+        start_ix = min(start_ix, end_ix)
+        return (self.valid_count[end_ix] - self.valid_count[start_ix]) == (end_ix - start_ix)
+
+    def eligible_symbols(self, start_ix: int, end_ix: int) -> List[str]:
+        eligible_a = self.eligible(start_ix, end_ix)
+        return [sym for sym, is_eligible in zip(self.symbols, eligible_a) if is_eligible]
+
+    def pair_eligible(self, sym_a: str, sym_b: str, start_ix: int, end_ix: int) -> bool:
+        """
+        :return: True if both symbols have a value on every date in the window [start_ix, end_ix)
+        """
+        end_ix = min(end_ix, self.valid_count.shape[0] - 1)
+        start_ix = min(start_ix, end_ix)
+        col_a = self.col_ix[sym_a]
+        col_b = self.col_ix[sym_b]
+        num_rows = end_ix - start_ix
+        return bool((self.valid_count[end_ix, col_a] - self.valid_count[start_ix, col_a]) == num_rows and
+                    (self.valid_count[end_ix, col_b] - self.valid_count[start_ix, col_b]) == num_rows)
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.convert_date import convert_dates
+
+
+def test_convert_dates_tz_aware_list():
+    # 22:00 US/Eastern is the next day in UTC, but the local date is kept
+    dates = [pd.Timestamp('2020-01-05 22:00', tz='US/Eastern'), pd.Timestamp('2020-01-07 22:00', tz='US/Eastern')]
+    expected = np.array(['2020-01-05', '2020-01-07'], dtype='datetime64[D]')
+    assert np.array_equal(convert_dates(dates), expected)
+
+
+def test_convert_dates_mixed_tz_aware_and_naive():
+    dates = [pd.Timestamp('2020-01-05 22:00', tz='US/Eastern'),
+             '2020-01-02',
+             datetime(2020, 1, 3, 23, 0),
+             np.datetime64('2020-01-04'),
+             pd.Timestamp('2020-01-06 08:00', tz='Asia/Tokyo')]
+    expected = np.array(['2020-01-05', '2020-01-02', '2020-01-03', '2020-01-04', '2020-01-06'], dtype='datetime64[D]')
+    assert np.array_equal(convert_dates(dates), expected)
+
+
+def test_convert_dates_mixed_keeps_local_time():
+    dates = [pd.Timestamp('2020-01-05 22:00', tz='US/Eastern'), datetime(2020, 1, 6, 9, 30)]
+    expected = np.array(['2020-01-05T22:00', '2020-01-06T09:30'], dtype='datetime64[ns]')
+    assert np.array_equal(convert_dates(dates, unit='ns'), expected)
+
+
+def test_convert_dates_tz_aware_index():
+    dates = pd.date_range('2020-01-05 22:00', periods=2, freq='D', tz='US/Eastern')
+    expected = np.array(['2020-01-05', '2020-01-06'], dtype='datetime64[D]')
+    assert np.array_equal(convert_dates(dates), expected)
+    assert np.array_equal(convert_dates(pd.Series(dates)), expected)
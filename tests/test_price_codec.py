@@ -0,0 +1,19 @@
+import numpy as np
+import pytest
+
+from read_market_data.price_codec import decode_cents, encode_cents, missing_cents
+
+
+def test_encode_cents_round_trip():
+    price_m = np.array([[1.23, np.nan], [21474836.47, 0.01]])
+    cents_m = encode_cents(price_m)
+    assert cents_m.dtype == np.int32
+    assert cents_m[0, 1] == missing_cents
+    assert np.array_equal(decode_cents(cents_m), price_m, equal_nan=True)
+
+
+@pytest.mark.parametrize('price', [21474836.48, 3.0e7, -21474836.48, np.inf])
+def test_encode_cents_overflow(price):
+    # without the range check, the cents wrap around (and can become the missing value sentinel)
+    with pytest.raises(ValueError):
+        encode_cents(np.array([1.0, price]))
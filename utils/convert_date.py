@@ -1,5 +1,6 @@
 
 import numpy as np
+import pandas as pd
 from datetime import datetime
 
 
@@ -12,3 +13,58 @@ def convert_date(some_date) -> datetime:
     # round datatime to year, month, day
     some_date = datetime(*some_date.timetuple()[:3])
     return some_date
+
+
+def convert_datetime(some_time) -> datetime:
+    """
+    Convert a string, numpy.datetime64, Timestamp or datetime to a datetime, keeping the time of day
+    (e.g., for intraday bars).
+    """
+    if type(some_time) == str:
+        some_time = datetime.fromisoformat(some_time)
+    elif type(some_time) == np.datetime64:
+        some_time = pd.Timestamp(some_time).to_pydatetime()
+    elif isinstance(some_time, pd.Timestamp):
+        some_time = some_time.to_pydatetime()
+    return some_time
+
+
+def convert_dates(dates, unit: str = 'D') -> np.ndarray:
+    """
+    The array counterpart of convert_date. Normalize an array, list, Series or DatetimeIndex of dates to a
+    day resolution datetime64[D] array. The dates may be a mix of str, datetime, Timestamp and
+    numpy.datetime64 values. Time zone aware dates are converted to their local (wall clock) date, so the
+    dates may mix time zones and naive values.
+
+    :param unit: the numpy datetime unit. With unit='ns' the time of day is kept (e.g., for intraday bars).
+    :return: a datetime64[unit] array with the same length as dates
+    """
+    if isinstance(dates, pd.Series):
+        dates = pd.Index(dates)
+    if isinstance(dates, pd.DatetimeIndex) and dates.tz is not None:
+        dates = dates.tz_localize(None)
+    dates_a = np.asarray(dates)
+    if not np.issubdtype(dates_a.dtype, np.datetime64):
+        dates_a = dates_a.astype('O')
+        try:
+            dates_ix = pd.to_datetime(dates_a)
+        except (ValueError, TypeError):
+            # a mix of time zone aware and naive values (or of time zones)
+            dates_ix = None
+        if not isinstance(dates_ix, pd.DatetimeIndex):
+            dates_ix = pd.DatetimeIndex([local_time(date) for date in dates_a])
+        elif dates_ix.tz is not None:
+            dates_ix = dates_ix.tz_localize(None)
+        dates_a = np.asarray(dates_ix.values)
+    return dates_a.astype(f'datetime64[{unit}]')
+
+
+def local_time(some_time) -> pd.Timestamp:
+    """
+    :return: the Timestamp for some_time, without a time zone. A time zone aware time is converted to its local
+             (wall clock) time.
+    """
+    some_time = pd.Timestamp(some_time)
+    if some_time.tz is not None:
+        some_time = some_time.tz_localize(None)
+    return some_time
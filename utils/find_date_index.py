@@ -1,10 +1,8 @@
-
 from datetime import datetime
 
-import pandas as pd
 from pandas import DatetimeIndex
 
-from utils.convert_date import convert_date
+from utils.trading_calendar import TradingCalendar
 
 
 def findDateIndex(date_index: DatetimeIndex, search_date: datetime) -> int:
@@ -12,20 +10,9 @@ def findDateIndex(date_index: DatetimeIndex, search_date: datetime) -> int:
     In a DatetimeIndex, find the index of the date that is nearest to search_date.
     This date will either be equal to search_date or the next date that is less than
     search_date
+
+    This builds a TradingCalendar for each call. Code that searches the same index more than once
+    should build the TradingCalendar once and use TradingCalendar.index_of.
     """
-    i = 0
-    search_date = convert_date(search_date)
-    date_t = datetime.today()
-    for i in range(0, len(date_index)):
-        if type(date_index) == pd.Series:
-            date_val = date_index.iloc[i]
-        else:
-            date_val = date_index[i]
-        date_t = convert_date(date_val)
-        if date_t >= search_date:
-            break
-    if date_t > search_date:
-        index = i - 1
-    else:
-        index = i
+    index = TradingCalendar(date_index).index_of(search_date)
     return index
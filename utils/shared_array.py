@@ -0,0 +1,91 @@
+
+from multiprocessing import shared_memory, util
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+class SharedArray:
+    """
+    A NumPy array in a named shared memory block. The parent process creates the array and worker processes
+    attach to it by name, so the array is not copied (or pickled) to the workers. The spec (the block name,
+    shape and dtype) is a small tuple that is passed to the workers once, when the worker pool is created.
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, shape: Tuple, dtype: str, owner: bool):
+        self.shm = shm
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.owner = owner
+        self.array = np.ndarray(self.shape, dtype=dtype, buffer=shm.buf)
+
+    @classmethod
+    def create(cls, shape: Tuple, dtype: str = 'float64', data: np.ndarray = None):
+        """
+        :param shape: the array shape
+        :param dtype: the array type
+        :param data: if not None, the initial values for the array
+        """
+        size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+        shared_array = cls(shared_memory.SharedMemory(create=True, size=size), shape, dtype, owner=True)
+        if data is not None:
+            shared_array.array[...] = data
+        return shared_array
+
+    @classmethod
+    def from_array(cls, data: np.ndarray):
+        return cls.create(data.shape, data.dtype.str, data)
+
+    @classmethod
+    def attach(cls, spec: Tuple):
+        name, shape, dtype = spec
+        return cls(shared_memory.SharedMemory(name=name), shape, dtype, owner=False)
+
+    def spec(self) -> Tuple:
+        return self.shm.name, self.shape, self.dtype
+
+    def close(self) -> None:
+        """
+        Release the array. The owner (the process that created the array) also frees the shared memory.
+        """
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# The shared arrays that a worker process has attached to, by key
+worker_arrays: Dict[str, SharedArray] = dict()
+# The (small) task parameters that are set when a worker process starts
+worker_params: dict = dict()
+
+
+def attach_worker_arrays(spec_dict: Dict[str, Tuple], params: dict = None) -> None:
+    """
+    A worker pool initializer. Attach the worker process to the shared arrays once, when the worker starts.
+
+    :param spec_dict: a dictionary of key -> SharedArray spec
+    :param params: other (small) values for the worker tasks, which are stored in worker_params
+    """
+    for key, spec in spec_dict.items():
+        worker_arrays[key] = SharedArray.attach(spec)
+    # Close the worker's handles when the worker process exits. Pool workers exit without running the atexit
+    # hooks, but they do run the multiprocessing finalizers. The worker does not own the arrays, so the shared
+    # memory is not unlinked (it is freed by the owner).
+    util.Finalize(None, close_worker_arrays, exitpriority=10)
+    worker_params.clear()
+    if params is not None:
+        worker_params.update(params)
+
+
+def worker_array(key: str) -> np.ndarray:
+    return worker_arrays[key].array
+
+
+def close_worker_arrays() -> None:
+    """
+    Close the shared arrays that the worker process attached to.
+    """
+    for shared_array in worker_arrays.values():
+        shared_array.close()
+    worker_arrays.clear()
@@ -0,0 +1,96 @@
+from datetime import datetime
+from typing import Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from utils.convert_date import convert_dates
+
+
+class TradingCalendar:
+    """
+    A sorted vector of trading dates that answers date -> index, index -> date and date range queries with a
+    binary search (numpy.searchsorted). The queries take a single date or an array of dates.
+
+    The calendar is built once for a date index (e.g., the index of the close price panel) and replaces the
+    linear scans in utils.find_date_index.findDateIndex. For a daily index the dates are compared at day
+    resolution, as in utils.convert_date.convert_date. For an intraday index (timestamps with a time of day)
+    the timestamps are compared at nanosecond resolution.
+    """
+
+    def __init__(self, date_index, unit: str = None):
+        """
+        :param date_index: a DatetimeIndex, Series or array of sorted dates
+        :param unit: the resolution, 'D' (days) or 'ns'. By default the resolution is 'D' if all of the dates
+                     are at midnight and 'ns' otherwise.
+        """
+        timestamps = convert_dates(date_index, 'ns')
+        if unit is None:
+            unit = 'D' if np.all(timestamps == timestamps.astype('datetime64[D]')) else 'ns'
+        self.unit = unit
+        self.dates = timestamps.astype(f'datetime64[{unit}]')
+        self.index = pd.DatetimeIndex(self.dates.astype('datetime64[ns]'))
+
+    @staticmethod
+    def to_unit(dates, unit: str) -> np.ndarray:
+        """
+        :param dates: a date (str, datetime, Timestamp or numpy.datetime64) or an array of dates
+        :param unit: the numpy datetime unit (e.g., 'D' or 'ns')
+        :return: a datetime64[unit] scalar or array
+        """
+        if np.ndim(dates) == 0:
+            timestamp = pd.Timestamp(dates)
+            if timestamp.tz is not None:
+                timestamp = timestamp.tz_localize(None)
+            converted = np.datetime64(timestamp, unit)
+        else:
+            converted = convert_dates(dates, unit)
+        return converted
+
+    def to_calendar(self, dates) -> np.ndarray:
+        """
+        :return: the dates at the resolution of the calendar
+        """
+        return self.to_unit(dates, self.unit)
+
+    def __len__(self) -> int:
+        return self.dates.shape[0]
+
+    def index_of(self, search_dates) -> Union[int, np.ndarray]:
+        """
+        Find the index of the date that is equal to the search date or, if the search date is not in the
+        calendar, the index of the nearest earlier date (the findDateIndex semantics). A search date before
+        the first date has an index of -1.
+
+        :param search_dates: a date or an array of dates
+        :return: an int for a single date or an int array
+        """
+        index = np.searchsorted(self.dates, self.to_calendar(search_dates), side='right') - 1
+        return int(index) if np.ndim(index) == 0 else index
+
+    def exact_index_of(self, search_dates) -> Union[int, np.ndarray]:
+        """
+        :return: the index of each search date or -1 if the date is not in the calendar
+        """
+        days = self.to_calendar(search_dates)
+        index = np.searchsorted(self.dates, days, side='left')
+        clipped = np.minimum(index, max(len(self) - 1, 0))
+        found = (index < len(self)) & (self.dates[clipped] == days) if len(self) > 0 else np.zeros(np.shape(days), dtype=bool)
+        index = np.where(found, index, -1)
+        return int(index) if np.ndim(index) == 0 else index
+
+    def date_at(self, ix) -> Union[datetime, pd.DatetimeIndex]:
+        """
+        :param ix: an index or an array of indexes
+        :return: a datetime for a single index or a DatetimeIndex
+        """
+        dates = self.index[ix]
+        return dates.to_pydatetime() if np.ndim(ix) == 0 else dates
+
+    def range_ix(self, start_date, end_date) -> Tuple[int, int]:
+        """
+        :return: the index range [start_ix, end_ix) of the dates in [start_date, end_date)
+        """
+        start_ix = int(np.searchsorted(self.dates, self.to_calendar(start_date), side='left'))
+        end_ix = int(np.searchsorted(self.dates, self.to_calendar(end_date), side='left'))
+        return start_ix, max(start_ix, end_ix)